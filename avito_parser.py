@@ -1,13 +1,45 @@
 import os
-import requests
-from bs4 import BeautifulSoup
+import argparse
+import asyncio
+import codecs
+import importlib.util
+import logging
+from bs4 import BeautifulSoup, SoupStrainer
 import hashlib
 import json
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 from enum import Enum
+from functools import partial
+from html.parser import HTMLParser
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+
+from downloader import Downloader
+from html_archive import HtmlArchive, read_page
+from listing_cache import STALE, ListingCache
+from metrics import Metrics, prometheus_values
+
+STREAM_CHUNK_SIZE = 64 * 1024
+# Версия правил извлечения: записи кэша другой версии считаются устаревшими
+PARSER_VERSION = 2
+
+logger = logging.getLogger(__name__)
+
+# Числовой ID объявления в конце пути: .../1-k._kvartira_406_m_69_et._4574477371
+LISTING_ID_RE = re.compile(r'_(\d+)$')
+# Краткое описание в поисковой выдаче: "1-к. квартира, 40,6 м², 6/9 эт.", "Дом 127,4 м² на участке 7,6 сот."
+SUMMARY_ROOMS_RE = re.compile(r'(\d+)-к\.')
+SUMMARY_AREA_RE = re.compile(r'(\d+(?:[,.]\d+)?)\s*м²')
+SUMMARY_FLOOR_RE = re.compile(r'(\d+)/(\d+)\s*эт\.')
+SUMMARY_PLOT_RE = re.compile(r'(\d+(?:[,.]\d+)?)\s*сот\.')
 
 class EstateParam(Enum):
     ROOMS = ("Количество комнат", "🚪 Комнат: {}")
-    TOTAL_AREA = ("Общая площадь", "📐 Общая площадь: {}")
+    TOTAL_AREA = ("Общая площадь", "📐 Общая площадь: {} м²")
     FLOOR = ("Этаж", "🪜  Этаж: {}")
     PLOT_AREA = ("Площадь участка", "🌳 Площадь участка: {}")
     HOUSE_TYPE = ("Тип дома", "🏡 Тип дома: {}")
@@ -17,82 +49,393 @@ class EstateParam(Enum):
     LAND_CATEGORY = ("Категория земель", "🏞️  Категория земель: {}")
     GARAGE_TYPE = ("Тип гаража", "🚗 Тип гаража: {}")
     PARKING_TYPE = ("Тип машиноместа", "🅿️ Тип машиноместа: {}")
-    ROOM_AREA = ("Площадь комнаты", "🛏️  Площадь комнаты: {}")
+    ROOM_AREA = ("Площадь комнаты", "🛏️  Площадь комнаты: {} м²")
     ROOMS_IN_APARTMENT = ("Комнат в квартире", "🏠 Комнат в квартире: {}")
-    HOUSE_AREA = ("Площадь дома", "🏠 Площадь дома: {}")
+    HOUSE_AREA = ("Площадь дома", "🏠 Площадь дома: {} м²")
     FLOORS_IN_HOUSE = ("Этажей в доме", "🏠 Этажей в доме: {}")
-    AREA = ("Площадь:", "📐 Площадь: {}")
+    AREA = ("Площадь:", "📐 Площадь: {} м²")
 
     def __init__(self, param_name, display_format):
         self.param_name = param_name
         self.display_format = display_format
 
-class AvitoParser:
-    def __init__(self, cache_dir="cache"):
-        self.price_value = None
-        self.full_address = None
-        self.type_estate = None
-        self.cache_dir = cache_dir
-        # Создаем директорию для кэша, если её нет
-        os.makedirs(self.cache_dir, exist_ok=True)
 
-        # Инициализируем все параметры как None
-        for param in EstateParam:
-            setattr(self, param.name.lower(), None)
+def _spaces(value):
+    # Неразрывные и повторяющиеся пробелы - один обычный
+    return ' '.join(value.split())
 
-    def _get_cache_filename(self, url):
-        # Хэшируем URL для создания уникального имени файла
-        url_hash = hashlib.md5(url.encode()).hexdigest()
-        return os.path.join(self.cache_dir, f"{url_hash}.json")
 
-    def _download_html(self, url):
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+def _area(value):
+    # "40,6 м²" -> "40.6": единица измерения - в формате вывода
+    return _spaces(value.replace('м²', '').replace(',', '.'))
+
+
+def _floor(value):
+    # "6 из 9" -> "6/9"
+    return _spaces(value).replace(' из ', '/')
+
+
+def _decimal(value):
+    # "7,6 сот." -> "7.6 сот."
+    return _spaces(value.replace(',', '.'))
+
+
+PARAM_NORMALIZERS = {
+    EstateParam.TOTAL_AREA: _area,
+    EstateParam.ROOM_AREA: _area,
+    EstateParam.HOUSE_AREA: _area,
+    EstateParam.AREA: _area,
+    EstateParam.FLOOR: _floor,
+    EstateParam.PLOT_AREA: _decimal,
+}
+
+FLAT_PARAMS = (EstateParam.ROOMS, EstateParam.TOTAL_AREA, EstateParam.FLOOR, EstateParam.FLOORS_IN_HOUSE,
+               EstateParam.HOUSE_TYPE, EstateParam.WALL_MATERIAL, EstateParam.BUILD_YEAR)
+ROOM_PARAMS = (EstateParam.ROOMS_IN_APARTMENT, EstateParam.ROOM_AREA, EstateParam.FLOOR,
+               EstateParam.FLOORS_IN_HOUSE, EstateParam.HOUSE_TYPE, EstateParam.WALL_MATERIAL,
+               EstateParam.BUILD_YEAR)
+HOUSE_PARAMS = (EstateParam.ROOMS, EstateParam.HOUSE_AREA, EstateParam.PLOT_AREA, EstateParam.FLOORS_IN_HOUSE,
+                EstateParam.HOUSE_TYPE, EstateParam.WALL_MATERIAL, EstateParam.BUILD_YEAR,
+                EstateParam.DISTANCE_TO_CENTER, EstateParam.LAND_CATEGORY)
+LAND_PARAMS = (EstateParam.PLOT_AREA, EstateParam.DISTANCE_TO_CENTER, EstateParam.LAND_CATEGORY)
+
+# Тип недвижимости: признаки в заголовке объявления и параметры, которые у него бывают.
+# Новая категория - новая строка здесь
+ESTATE_SCHEMA = {
+    'Квартира': (('квартира',), FLAT_PARAMS),
+    'Студия': (('Квартира-студия',), FLAT_PARAMS),
+    'Свободная планировка': (('Своб. планировка',), FLAT_PARAMS),
+    'Комната': (('Комната',), ROOM_PARAMS),
+    'Дом': (('Дом',), HOUSE_PARAMS),
+    'Дача': (('Дача',), HOUSE_PARAMS),
+    'Коттедж': (('Коттедж',), HOUSE_PARAMS),
+    'Таунхаус': (('Таунхаус',), HOUSE_PARAMS),
+    'ИЖС': (('ИЖС',), LAND_PARAMS),
+    'СНТ': (('СНТ, ДНП',), LAND_PARAMS),
+    'Гараж': (('Гараж,',), (EstateParam.GARAGE_TYPE, EstateParam.AREA)),
+    'Машиноместо': (('Машиноместо',), (EstateParam.PARKING_TYPE, EstateParam.AREA)),
+}
+
+# Площадь из краткого описания в выдаче: у каждого типа своя. У участков её там нет
+SUMMARY_AREA_PARAMS = {
+    'Квартира': EstateParam.TOTAL_AREA,
+    'Студия': EstateParam.TOTAL_AREA,
+    'Свободная планировка': EstateParam.TOTAL_AREA,
+    'Комната': EstateParam.ROOM_AREA,
+    'Дом': EstateParam.HOUSE_AREA,
+    'Дача': EstateParam.HOUSE_AREA,
+    'Коттедж': EstateParam.HOUSE_AREA,
+    'Таунхаус': EstateParam.HOUSE_AREA,
+    'Гараж': EstateParam.AREA,
+    'Машиноместо': EstateParam.AREA,
+}
+
+
+def normalize_param(param, value):
+    return PARAM_NORMALIZERS.get(param, _spaces)(value)
+
+
+def normalize_params(params):
+    # {EstateParam.name: значение} из записей PARSER_VERSION 1 ("40,6 м²", "6 из 9") - в текущий формат.
+    # Нормализация повторно не меняет уже приведённые значения
+    return {
+        name: normalize_param(EstateParam[name], value) if name in EstateParam.__members__ else value
+        for name, value in params.items()
+    }
+
+
+def _compile_schema(schema):
+    # Все признаки типов - одно регулярное выражение: побеждает самый левый признак,
+    # а на одной позиции - самый длинный ("Квартира-студия", а не "квартира").
+    # Поля каждого типа - (параметр, название на странице, нормализация) в порядке EstateParam
+    title_types = {marker: estate_type for estate_type, (markers, _) in schema.items() for marker in markers}
+    title_re = re.compile('|'.join(re.escape(marker) for marker in sorted(title_types, key=len, reverse=True)))
+
+    def fields(params):
+        return tuple((param, param.param_name.rstrip(':'), PARAM_NORMALIZERS.get(param, _spaces))
+                     for param in EstateParam if param in params)
+
+    type_fields = {estate_type: fields(params) for estate_type, (_, params) in schema.items()}
+    return title_re, title_types, type_fields, fields(tuple(EstateParam))
+
+
+TITLE_RE, TITLE_TYPES, TYPE_FIELDS, ALL_FIELDS = _compile_schema(ESTATE_SCHEMA)
+# Названия параметров на странице: остальные пункты блока параметров не сохраняются
+PARAM_LABELS = frozenset(label for _, label, _ in ALL_FIELDS)
+
+@dataclass(frozen=True, slots=True)
+class Listing:
+    url: str
+    listing_id: str
+    type_estate: str
+    price_value: str
+    full_address: str
+    # Пары (EstateParam.name, значение) только для найденных параметров
+    params: tuple = ()
+    # Запись из поисковой выдачи: параметры только из краткого описания,
+    # при обращении к объявлению она дополняется загрузкой его страницы
+    partial: bool = False
+
+    def get(self, param):
+        for name, value in self.params:
+            if name == param.name:
+                return value
+        return None
+
+    def to_dict(self):
+        return {
+            "url": self.url,
+            "listing_id": self.listing_id,
+            "type_estate": self.type_estate,
+            "price_value": self.price_value,
+            "full_address": self.full_address,
+            "params": dict(self.params),
+            "partial": self.partial,
         }
-        response = requests.get(url, headers=headers)
-        if response.status_code != 200:
-            raise Exception(f"Ошибка при загрузке страницы: {response.status_code}")
-        return response.text
-
-    def _process_address(self, address):
-        parts = address.split(',')
-        if 'ул.' in parts[-2]:
-            processed_parts = [part + '\n 📍' for part in parts[:-2]]
-            processed_parts.append(f"{parts[-2]},{parts[-1]}")
-        else:
-            processed_parts = [part + '\n 📍' for part in parts[:-1]]
-            processed_parts.append(parts[-1])
-        address = ''.join(processed_parts)
+
+    @classmethod
+    def from_dict(cls, data):
+        params = data.get("params", {})
+        return cls(
+            url=data["url"],
+            listing_id=data["listing_id"],
+            type_estate=data["type_estate"],
+            price_value=data["price_value"],
+            full_address=data["full_address"],
+            params=tuple((param.name, params[param.name]) for param in EstateParam if param.name in params),
+            partial=data.get("partial", False),
+        )
+
+
+def process_address(address):
+    parts = address.split(',')
+    if len(parts) < 2:
         return address
+    if 'ул.' in parts[-2]:
+        processed_parts = [part + '\n 📍' for part in parts[:-2]]
+        processed_parts.append(f"{parts[-2]},{parts[-1]}")
+    else:
+        processed_parts = [part + '\n 📍' for part in parts[:-1]]
+        processed_parts.append(parts[-1])
+    address = ''.join(processed_parts)
+    return address
+
+
+def render_listing(listing):
+    # Формируем итоговую HTML-строку для сообщения
+    result = []
+    result.append(f"🌟 <b>{listing.type_estate}</b>")
+    result.append(f"💵 {listing.price_value}₽\n")
+    result.append(f"⛳️ {process_address(listing.full_address)}\n")
+
+    # Добавляем только найденные параметры
+    for param in EstateParam:
+        value = listing.get(param)
+        if value is not None:
+            result.append(param.display_format.format(value))
+
+    # Объединяем строки с переносами
+    result.append('\n\n')
+    return "\n".join(result)
+
+
+def _search_page_url(url, page):
+    # Страницы выдачи отличаются параметром ?p=N, первая - без него
+    parts = urlsplit(url)
+    query = [(name, value) for name, value in parse_qsl(parts.query) if name != 'p']
+    if page > 1:
+        query.append(('p', str(page)))
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def _finish_prefetch(task):
+    # Загрузка следующей страницы больше не нужна: отменяем и забираем ошибку, если она была
+    if task is not None:
+        task.cancel()
+        if task.done() and not task.cancelled():
+            task.exception()
+
+
+def _is_target_region(name, attrs):
+    # Из всей страницы нужны только заголовок, цена, блок параметров и адрес
+    attrs = attrs or {}
+    if name == 'title':
+        return True
+    if name == 'div':
+        return attrs.get('data-marker') == 'item-view/item-params'
+    if name == 'span':
+        classes = attrs.get('class') or ''
+        if isinstance(classes, str):
+            classes = classes.split()
+        return attrs.get('itemprop') == 'price' or 'style-item-address__string-wt61A' in classes
+    return False
+
+
+try:
+    from bs4.filter import ElementFilter
+
+    # bs4 >= 4.13: решение о создании тега принимает ElementFilter
+    class _RegionFilter(ElementFilter):
+        def allow_tag_creation(self, nsprefix, name, attrs):
+            return _is_target_region(name, attrs)
+
+        def allow_string_creation(self, string):
+            return False
+
+    REGIONS_ONLY = _RegionFilter()
+except ImportError:
+    REGIONS_ONLY = SoupStrainer(_is_target_region)
+
+# В поисковой выдаче нужны только карточки объявлений
+SEARCH_ITEMS_ONLY = SoupStrainer('div', attrs={'data-marker': 'item'})
+
+
+class ListingStream(HTMLParser):
+    # Потоковый разбор страницы по кускам: собирает заголовок, цену, параметры и адрес
+    # и сообщает через done, что остаток страницы можно не скачивать
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = None
+        self.price = None
+        self.params_index = None
+        self.address = None
+        self._title_parts = None
+        self._address_parts = None
+        self._address_depth = 0
+        self._params_depth = 0
+        self._in_item = False
+        self._label_parts = None
+        self._label_depth = 0
+        self._label = None
+        self._value_parts = []
+
+    @property
+    def done(self):
+        return (self.title is not None and self.price is not None
+                and self.params_index is not None and self._params_depth == 0
+                and self.address is not None)
+
+    def _flush_value(self):
+        # Значение параметра - весь текст между </span> и следующим тегом
+        if self._label in PARAM_LABELS and self._value_parts:
+            self.params_index.setdefault(self._label, ''.join(self._value_parts).strip())
+        self._label = None
+        self._value_parts = []
+
+    def handle_starttag(self, tag, attrs):
+        self._flush_value()
+        attrs = dict(attrs)
+        classes = (attrs.get('class') or '').split()
+
+        if tag == 'title' and self.title is None:
+            self._title_parts = []
+        elif tag == 'span' and attrs.get('itemprop') == 'price' and self.price is None:
+            self.price = attrs.get('content') or 'Не указано'
+
+        # Адрес: весь текст внутри span, включая вложенные теги
+        if self._address_parts is not None and tag == 'span':
+            self._address_depth += 1
+        elif tag == 'span' and 'style-item-address__string-wt61A' in classes and self.address is None:
+            self._address_parts = []
+            self._address_depth = 1
+
+        # Блок параметров: "<li><span>Название: </span>значение</li>"
+        if self._params_depth:
+            if tag == 'div':
+                self._params_depth += 1
+            elif tag == 'li' and 'params-paramsList__item-_2Y2O' in classes:
+                self._in_item = True
+            elif tag == 'span' and self._label_parts is not None:
+                self._label_depth += 1
+            elif tag == 'span' and self._in_item and 'styles-module-noAccent-l9CMS' in classes:
+                self._in_item = False
+                self._label_parts = []
+                self._label_depth = 1
+        elif tag == 'div' and attrs.get('data-marker') == 'item-view/item-params' and self.params_index is None:
+            self.params_index = {}
+            self._params_depth = 1
+
+    def handle_endtag(self, tag):
+        self._flush_value()
+        if tag == 'title' and self._title_parts is not None:
+            self.title = ''.join(self._title_parts)
+            self._title_parts = None
+
+        if tag == 'span' and self._address_parts is not None:
+            self._address_depth -= 1
+            if not self._address_depth:
+                self.address = ''.join(self._address_parts).strip()
+                self._address_parts = None
+
+        if self._params_depth:
+            if tag == 'div':
+                self._params_depth -= 1
+            elif tag == 'li':
+                self._in_item = False
+            elif tag == 'span' and self._label_parts is not None:
+                self._label_depth -= 1
+                if not self._label_depth:
+                    self._label = ''.join(self._label_parts).strip().rstrip(':').strip()
+                    self._label_parts = None
+
+    def handle_data(self, data):
+        if self._title_parts is not None:
+            self._title_parts.append(data)
+        if self._address_parts is not None:
+            self._address_parts.append(data)
+        if self._label_parts is not None:
+            self._label_parts.append(data)
+        elif self._label is not None:
+            self._value_parts.append(data)
+
+    def close(self):
+        super().close()
+        self._flush_value()
+
+
+class ListingExtractor:
+    # Разбор страниц без сети и кэша: этого достаточно процессам пула (см. _init_worker)
+    def __init__(self, backend="html.parser", metrics=None):
+        self.metrics = metrics or Metrics()
+        # "html.parser" строит дерево всей страницы, "lxml" разбирает только нужные фрагменты
+        if backend == "lxml" and importlib.util.find_spec("lxml") is None:
+            logger.warning("lxml не установлен, используется html.parser")
+            backend = "html.parser"
+        self.backend = backend
+
+    def _get_listing_key(self, url):
+        # Ключ объявления - его числовой ID, параметр ?context=... не учитывается.
+        # Если ID в URL нет, используем хэш URL, как раньше
+        path = urlsplit(url).path.rstrip('/')
+        if match := LISTING_ID_RE.search(path):
+            return match.group(1)
+        return hashlib.md5(url.encode()).hexdigest()
+
+    def _finish_stream(self, extractor, url):
+        if not extractor.done:
+            extractor.close()
+        return self._build_listing(
+            url,
+            title=extractor.title,
+            price=extractor.price,
+            params_index=extractor.params_index or {},
+            address=extractor.address,
+        )
 
     def _extract_type_estate(self, title):
-        estate_types_mapping = {
-            'квартира': 'Квартира',
-            'Квартира-студия': 'Студия',
-            'Своб. планировка': 'Свободная планировка',
-            'Комната': 'Комната',
-            'Дом': 'Дом',
-            'Дача': 'Дача',
-            'Коттедж': 'Коттедж',
-            'Таунхаус': 'Таунхаус',
-            'ИЖС': 'ИЖС',
-            'СНТ, ДНП': 'СНТ',
-            'Гараж,': 'Гараж',
-            'Машиноместо': 'Машиноместо'
-        }
-        
-        for search_string, estate_type in estate_types_mapping.items():
-            if search_string in title:
-                return estate_type
-        
-        return "Не указано"
-
-    def _extract_param(self, params_soup, param_name):
-        for li in params_soup.find_all('li', class_='params-paramsList__item-_2Y2O'):
+        match = TITLE_RE.search(title)
+        return TITLE_TYPES[match.group()] if match else "Не указано"
+
+    def _index_params(self, params_block):
+        # Один проход по блоку параметров: название -> значение
+        params_index = {}
+        for li in params_block.find_all('li', class_='params-paramsList__item-_2Y2O'):
             span = li.find('span', class_='styles-module-noAccent-l9CMS')
-            if span and param_name in span.text:
-                return span.next_sibling.strip()
-        return None
+            if span and isinstance(span.next_sibling, str):
+                label = span.text.strip().rstrip(':').strip()
+                if label in PARAM_LABELS:
+                    params_index.setdefault(label, span.next_sibling.strip())
+        return params_index
 
     def _format_price(self, price):
         try:
@@ -101,64 +444,527 @@ class AvitoParser:
         except (ValueError, AttributeError):
             return price
 
-    def parse(self, url):
-        cache_file = self._get_cache_filename(url)
+    def _extract_search(self, html, url):
+        parser_name = 'lxml' if self.backend == 'lxml' else 'html.parser'
+        soup = BeautifulSoup(html, parser_name, parse_only=SEARCH_ITEMS_ONLY)
+        listings = []
+        for item in soup.find_all('div', {'data-marker': 'item'}):
+            link = item.find('a', {'data-marker': 'item-title'})
+            if link is None or not link.get('href'):
+                continue
+            # Ссылка без ?context=..., как и ключ объявления
+            item_url = urljoin(url, link['href'].split('?')[0])
+            title = link.get_text(' ', strip=True)
+            price = item.find('meta', {'itemprop': 'price'})
+            address = item.find(attrs={'data-marker': 'item-address'})
+            type_estate = self._extract_type_estate(title)
+            listings.append(Listing(
+                url=item_url,
+                listing_id=self._get_listing_key(item_url),
+                type_estate=type_estate,
+                price_value=self._format_price(price.get('content') if price else 'Не указано'),
+                full_address=address.get_text(', ', strip=True) if address else "Не указано",
+                params=self._summary_params(type_estate, title),
+                partial=True,
+            ))
+        return listings
 
-        # Если файл с кэшем существует, читаем из него
-        if os.path.exists(cache_file):
-            with open(cache_file, "r", encoding="utf-8") as file:
-                return json.load(file)
+    def _summary_params(self, type_estate, title):
+        # Краткое описание: "1-к. квартира, 40,6 м², 6/9 эт.", "Комната 13 м² в 3-к. квартире, 2/5 эт."
+        if type_estate not in TYPE_FIELDS:
+            return ()
+        found = {}
+        if (match := SUMMARY_AREA_RE.search(title)) and type_estate in SUMMARY_AREA_PARAMS:
+            found[SUMMARY_AREA_PARAMS[type_estate]] = match.group(1)
+        if match := SUMMARY_ROOMS_RE.search(title):
+            rooms = EstateParam.ROOMS_IN_APARTMENT if type_estate == 'Комната' else EstateParam.ROOMS
+            found[rooms] = match.group(1)
+        if match := SUMMARY_FLOOR_RE.search(title):
+            found[EstateParam.FLOOR] = f"{match.group(1)}/{match.group(2)}"
+            found[EstateParam.FLOORS_IN_HOUSE] = match.group(2)
+        if match := SUMMARY_PLOT_RE.search(title):
+            found[EstateParam.PLOT_AREA] = match.group(1) + ' сот.'
+        return tuple((param.name, normalize_param(param, found[param])) for param in EstateParam if param in found)
 
-        # Скачиваем HTML
-        html = self._download_html(url)
+    def _make_soup(self, html):
+        if self.backend == "lxml":
+            soup = BeautifulSoup(html, 'lxml', parse_only=REGIONS_ONLY)
+            if soup.find('title') or soup.find('span', {'itemprop': 'price'}):
+                return soup
+            # Фрагменты не нашлись - разбираем страницу целиком, как раньше
+            logger.debug("Выборочный разбор не нашёл нужных блоков, разбираем страницу целиком")
+        return BeautifulSoup(html, 'html.parser')
 
+    def _parse_html(self, html, url):
         # Парсим HTML
-        soup = BeautifulSoup(html, 'html.parser')
+        with self.metrics.stage("parse"):
+            soup = self._make_soup(html)
+        with self.metrics.stage("extract"):
+            return self._extract_listing(soup, url)
 
+    def _extract_listing(self, soup, url):
         # Извлекаем заголовок страницы
-        title = soup.find('title').text if soup.find('title') else "Не указано"
-        self.type_estate = self._extract_type_estate(title)
+        title_element = soup.find('title')
 
         # Извлекаем цену
         price_span = soup.find('span', {'itemprop': 'price'})
-        self.price_value = price_span.get('content', 'Не указано') if price_span else 'Не указано'
-        self.price_value = self._format_price(self.price_value)
 
         # Извлекаем параметры, если блок параметров существует
+        params_index = {}
         if params_block := soup.find('div', {'data-marker': 'item-view/item-params'}):
-            params_soup = BeautifulSoup(params_block.decode_contents(), 'html.parser')
-
-            # Извлекаем все параметры
-            for param in EstateParam:
-                value = self._extract_param(params_soup, param.param_name)
-                setattr(self, param.name.lower(), value)
+            params_index = self._index_params(params_block)
 
         # Извлекаем адрес
         address_element = soup.find('span', class_='style-item-address__string-wt61A')
-        self.full_address = address_element.text.strip() if address_element else "Не указано"
-        self.full_address = self._process_address(self.full_address)
-
-        # Формируем итоговую строку
-        result = []
-        result.append(f"🌟 <b>{self.type_estate}</b>")
-        result.append(f"💵 {self.price_value}₽\n")
-        result.append(f"⛳️ {self.full_address}\n")
-
-        # Динамически добавляем параметры, если они не None
-        for param in EstateParam:
-            value = getattr(self, param.name.lower())
+
+        return self._build_listing(
+            url,
+            title=title_element.text if title_element else None,
+            price=price_span.get('content', 'Не указано') if price_span else None,
+            params_index=params_index,
+            address=address_element.text.strip() if address_element else None,
+        )
+
+    def _build_listing(self, url, title, price, params_index, address):
+        # Общая сборка записи для полного и потокового разбора
+        type_estate = self._extract_type_estate(title or "Не указано")
+        return Listing(
+            url=url,
+            listing_id=self._get_listing_key(url),
+            type_estate=type_estate,
+            price_value=self._format_price(price or 'Не указано'),
+            full_address=address or "Не указано",
+            params=self._collect_params(type_estate, params_index),
+        )
+
+    def _collect_params(self, type_estate, params_index):
+        # Только поля, которые бывают у этого типа; у неизвестного типа - все
+        params = []
+        for param, label, normalize in TYPE_FIELDS.get(type_estate, ALL_FIELDS):
+            value = params_index.get(label)
             if value is not None:
-                result.append(param.display_format.format(value))
+                params.append((param.name, normalize(value)))
+        return tuple(params)
+
+
+# Разборщик внутри процесса-обработчика пула, создаётся в _init_worker()
+_worker_extractor = None
+
+
+def _init_worker(backend):
+    # Прогреваем процесс: bs4 уже импортирован, первый разбор не платит за ленивую инициализацию.
+    # Кэш и загрузчик процессу не нужны - базу SQLite он не открывает
+    global _worker_extractor
+    _worker_extractor = ListingExtractor(backend)
+    _worker_extractor._make_soup("<html><title></title></html>")
+
+
+def _worker_ready():
+    return os.getpid()
+
+
+def _parse_in_worker(html, url):
+    return _worker_extractor._parse_html(html, url)
+
+
+def _search_in_worker(html, url):
+    return _worker_extractor._extract_search(html, url)
 
-        # Объединяем строки с переносами
-        result.append('\n\n')
-        result_str = "\n".join(result)
 
-        # Сохраняем результат в кэш
-        with open(cache_file, "w", encoding="utf-8") as file:
-            json.dump(result_str, file, ensure_ascii=False)
+def _reparse_page(archive_root, page):
+    listing_id, url, sha256, codec, fetched_at = page
+    try:
+        html = read_page(archive_root, sha256, codec)
+        return _worker_extractor._parse_html(html, url).to_dict(), fetched_at
+    except Exception as e:
+        logger.warning(f"Не удалось разобрать архивную страницу {listing_id}: {e}")
+        return None
+
+
+def reparse_archive(cache_dir="cache", workers=None, backend="html.parser"):
+    # Пересобирает записи кэша из архива страниц по текущим правилам извлечения,
+    # на всех ядрах и без обращения к сайту. Время загрузки берётся из архива
+    parser = AvitoParser(cache_dir=cache_dir, backend=backend, archive=True)
+    pages = parser.archive.latest()
+    rows = []
+    rebuilt = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(backend,)) as pool:
+        for result in pool.map(partial(_reparse_page, parser.archive.root), pages, chunksize=32):
+            if result is None:
+                continue
+            data, fetched_at = result
+            rows.append((data, fetched_at, parser.cache.ttl))
+            if len(rows) >= 1000:
+                parser.cache.disk.put_many(rows, PARSER_VERSION)
+                rebuilt += len(rows)
+                rows = []
+    parser.cache.disk.put_many(rows, PARSER_VERSION)
+    rebuilt += len(rows)
+    return rebuilt, len(pages) - rebuilt
+
+
+class AvitoParser(ListingExtractor):
+    # Экземпляр хранит только настройки и общие ресурсы (кэш, HTTP-сессию),
+    # результаты разбора возвращаются неизменяемыми записями Listing,
+    # поэтому один парсер можно вызывать из многих задач и потоков сразу
+    def __init__(self, cache_dir="cache", workers=0, max_pending=None, backend="html.parser", stream=False,
+                 cache_ttl=24 * 3600, cache_stale_ttl=7 * 24 * 3600,
+                 cache_max_entries=10000, cache_max_bytes=64 * 1024 * 1024, archive=False, archive_keep=3,
+                 downloader=None, metrics=None):
+        # Длительности этапов разбора (загрузка, разбор, извлечение, кэш) - для /stats и Prometheus
+        super().__init__(backend, metrics)
+        self.cache_dir = cache_dir
+        # Пул соединений, ограничение частоты запросов и повторы - в Downloader
+        self.downloader = downloader or Downloader()
+        # Сжатый архив скачанных страниц для пересборки записей без сети (см. reparse_archive);
+        # для каждого объявления хранятся archive_keep последних страниц
+        self.archive = HtmlArchive(os.path.join(cache_dir, "html"), archive_keep) if archive else None
+        # При stream=True страница разбирается по мере загрузки, соединение закрывается,
+        # как только найдены заголовок, цена, параметры и адрес
+        self.stream = stream
+        # При workers > 0 разбор HTML уходит в пул процессов, загрузка остаётся в цикле событий.
+        # max_pending ограничивает число страниц, ожидающих разбора: остальные ждут очереди
+        self.workers = workers
+        self.max_pending = max_pending or workers * 4
+        self.pool = None
+        self._pending = None
+        # Кэш: LRU в памяти перед SQLite, устаревшие записи обновляются в фоне
+        self.cache = ListingCache(
+            cache_dir,
+            decode=Listing.from_dict,
+            parser_version=PARSER_VERSION,
+            ttl=cache_ttl,
+            stale_ttl=cache_stale_ttl,
+            max_entries=cache_max_entries,
+            max_bytes=cache_max_bytes,
+        )
+        self._refreshing = set()
+        self._refresh_lock = threading.Lock()
+        self._background = set()
+        # Загрузки, которые сейчас выполняются: ключ объявления -> задача
+        self._inflight = {}
+
+    async def start(self):
+        # Одна сессия с пулом keep-alive соединений на всё время работы
+        await self.downloader.start()
+        if self.workers and self.pool is None:
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(self.backend,),
+            )
+            self._pending = asyncio.Semaphore(self.max_pending)
+            # Запускаем все процессы заранее, чтобы первые сообщения не ждали их старта
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*(loop.run_in_executor(self.pool, _worker_ready) for _ in range(self.workers)))
+
+    async def close(self):
+        await self.downloader.close()
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def export_metrics(self):
+        # Текст для Prometheus: этапы разбора, счётчики кэша и загрузчика
+        cache = self.cache.snapshot()
+        lines = self.metrics.prometheus()
+        lines += prometheus_values("avito_cache_events_total", "counter", {
+            name: cache[name] for name in ("memory_hits", "disk_hits", "stale_hits", "misses", "evictions")
+        }, "event")
+        lines += prometheus_values("avito_cache_memory", "gauge", {
+            "entries": cache["memory_entries"], "bytes": cache["memory_bytes"],
+        }, "kind")
+        lines += prometheus_values("avito_http_events_total", "counter", self.downloader.stats, "event")
+        return "\n".join(lines) + "\n"
 
-        return result_str
+    def _download_html(self, url):
+        return self.downloader.fetch_text_sync(url)
+
+    async def _download_html_async(self, url):
+        return await self.downloader.fetch_text(url)
+
+    def _stream_listing(self, url):
+        # Возвращает запись и прочитанную часть страницы (если её нужно архивировать)
+        extractor = ListingStream()
+        parts = [] if self.archive is not None else None
+        with self.downloader.open_sync(url) as response:
+            response.encoding = response.encoding or "utf-8"
+            for text in response.iter_content(STREAM_CHUNK_SIZE, decode_unicode=True):
+                extractor.feed(text)
+                if parts is not None:
+                    parts.append(text)
+                if extractor.done:
+                    break
+        return self._finish_stream(extractor, url), parts and ''.join(parts)
+
+    async def _stream_listing_async(self, url):
+        extractor = ListingStream()
+        parts = [] if self.archive is not None else None
+        async with self.downloader.open(url) as response:
+            decoder = codecs.getincrementaldecoder(response.charset or "utf-8")(errors="replace")
+            async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                text = decoder.decode(chunk)
+                extractor.feed(text)
+                if parts is not None:
+                    parts.append(text)
+                if extractor.done:
+                    # Остаток страницы не нужен: закрываем соединение, не дочитывая его
+                    response.close()
+                    break
+        return self._finish_stream(extractor, url), parts and ''.join(parts)
+
+    def _claim_refresh(self, key):
+        # Одно фоновое обновление на объявление
+        with self._refresh_lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def _release_refresh(self, key):
+        with self._refresh_lock:
+            self._refreshing.discard(key)
+
+    def parse(self, url):
+        key = self._get_listing_key(url)
+        # Если запись в кэше существует, отдаём её сразу
+        with self.metrics.stage("cache_read"):
+            cached = self.cache.get(key)
+        if cached:
+            listing, state = cached
+            # Устаревшую или неполную (из выдачи) запись отдаём сразу и обновляем в фоне
+            if (state == STALE or listing.partial) and self._claim_refresh(key):
+                threading.Thread(target=self._refresh, args=(key, url), daemon=True).start()
+            return listing
+
+        return self._fetch(key, url)
+
+    def _fetch(self, key, url):
+        if self.stream:
+            with self.metrics.stage("stream"):
+                listing, html = self._stream_listing(url)
+        else:
+            with self.metrics.stage("download"):
+                html = self._download_html(url)
+            listing = self._parse_html(html, url)
+        self._store(key, listing, html)
+        return listing
+
+    def _store(self, key, listing, html):
+        # При потоковом разборе в архив попадает только прочитанное начало страницы -
+        # в нём уже есть все нужные блоки
+        if self.archive is not None and html:
+            with self.metrics.stage("archive"):
+                self.archive.put(key, listing.url, html)
+        with self.metrics.stage("cache_write"):
+            self.cache.put(key, listing)
+
+    async def _store_async(self, key, listing, html):
+        # Сжатие страницы и запись файла не должны держать цикл событий
+        if self.archive is not None and html:
+            with self.metrics.stage("archive"):
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(None, self.archive.put, key, listing.url, html)
+        with self.metrics.stage("cache_write"):
+            self.cache.put(key, listing)
+
+    def _refresh(self, key, url):
+        try:
+            self._fetch(key, url)
+        except Exception as e:
+            logger.warning(f"Не удалось обновить {url}: {e}")
+        finally:
+            self._release_refresh(key)
+
+    async def parse_async(self, url, use_cache=True):
+        # То же, что parse(), но загрузка страницы не блокирует цикл событий.
+        # use_cache=False всегда загружает страницу заново (например, для профилирования)
+        listing, _ = await self._lookup_async(url, use_cache)
+        return listing
+
+    async def _lookup_async(self, url, use_cache=True, wait_refresh=False):
+        # Возвращает (запись, взята ли она из кэша). Устаревшую или неполную (из выдачи)
+        # запись обычно отдаём сразу и обновляем в фоне; wait_refresh=True обновляет её
+        # до ответа, а при ошибке загрузки отдаёт то, что есть в кэше
+        key = self._get_listing_key(url)
+        cached = None
+        if use_cache:
+            with self.metrics.stage("cache_read"):
+                cached = self.cache.get(key)
+        if not cached:
+            return await self._fetch_once(key, url), False
+
+        listing, state = cached
+        if state != STALE and not listing.partial:
+            return listing, True
+        if wait_refresh:
+            try:
+                return await self._fetch_once(key, url), False
+            except Exception as e:
+                logger.warning(f"Не удалось обновить {url}: {e}")
+                return listing, True
+        if self._claim_refresh(key):
+            task = asyncio.create_task(self._refresh_async(key, url))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+        return listing, True
+
+    async def _fetch_once(self, key, url):
+        # Одновременные запросы одного объявления ждут одну и ту же загрузку
+        # и получают один и тот же результат или одну и ту же ошибку
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch_async(key, url))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish_inflight(key, done))
+        # shield: отмена одного ожидающего не отменяет загрузку для остальных
+        return await asyncio.shield(task)
+
+    def _finish_inflight(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Ошибку забрали ожидающие; если их не осталось, не пишем предупреждение в лог
+        if not task.cancelled():
+            task.exception()
+
+    async def _fetch_async(self, key, url):
+        if self.stream:
+            with self.metrics.stage("stream"):
+                listing, html = await self._stream_listing_async(url)
+        else:
+            with self.metrics.stage("download"):
+                html = await self._download_html_async(url)
+            listing = await self._parse_html_async(html, url)
+        await self._store_async(key, listing, html)
+        return listing
+
+    async def _refresh_async(self, key, url):
+        try:
+            await self._fetch_once(key, url)
+        except Exception as e:
+            logger.warning(f"Не удалось обновить {url}: {e}")
+        finally:
+            self._release_refresh(key)
+
+    async def _parse_html_async(self, html, url):
+        if self.pool is None:
+            return self._parse_html(html, url)
+        # В пуле этапы не разделить: "parse" включает ожидание очереди и извлечение полей
+        with self.metrics.stage("parse"):
+            async with self._pending:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self.pool, _parse_in_worker, html, url)
+
+    async def parse_search(self, url, pages=1):
+        # Асинхронный генератор неполных записей со страниц поисковой выдачи: одна загрузка
+        # на ~50 объявлений. Следующая страница загружается, пока разбирается текущая.
+        # Записи попадают в кэш, не вытесняя свежие полные
+        async def load(page):
+            page_url = _search_page_url(url, page)
+            with self.metrics.stage("download"):
+                return page_url, await self._download_html_async(page_url)
+
+        prefetch = asyncio.create_task(load(1))
+        try:
+            for page in range(1, pages + 1):
+                page_url, html = await prefetch
+                prefetch = asyncio.create_task(load(page + 1)) if page < pages else None
+                listings = await self._extract_search_async(html, page_url)
+                if not listings:
+                    # Страницы закончились
+                    break
+                with self.metrics.stage("cache_write"):
+                    for listing in listings:
+                        self.cache.put_partial(listing.listing_id, listing)
+                for listing in listings:
+                    yield listing
+        finally:
+            _finish_prefetch(prefetch)
+
+    async def _extract_search_async(self, html, url):
+        with self.metrics.stage("parse"):
+            if self.pool is None:
+                return self._extract_search(html, url)
+            async with self._pending:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self.pool, _search_in_worker, html, url)
+
+async def _batch_item(parser, url):
+    try:
+        # Уже разобранные объявления берём из кэша: прерванный запуск продолжается с того же места.
+        # Устаревшие и неполные записи обновляются сразу - в выгрузку попадают полные данные
+        listing, cached = await parser._lookup_async(url, wait_refresh=True)
+        return {"url": url, "status": "ok", "cached": cached, "listing": listing.to_dict()}
+    except Exception as e:
+        return {"url": url, "status": "error", "error": str(e)}
+
+
+async def parse_batch(parser, urls, concurrency=16):
+    # Асинхронный генератор результатов в порядке готовности. Очереди ограничены,
+    # поэтому в памяти одновременно не больше нескольких десятков URL и записей
+    urls_queue = asyncio.Queue(maxsize=concurrency * 2)
+    results = asyncio.Queue(maxsize=concurrency * 2)
+    finished = object()
+
+    async def produce():
+        # Рабочих отпускаем и тогда, когда чтение источника оборвалось ошибкой
+        # (например, строка не в UTF-8): сама ошибка поднимается ниже, у потребителя.
+        # При отмене (CancelledError) рабочие отменены тоже - ждать место в очереди некому
+        error = None
+        try:
+            for url in urls:
+                if url := url.strip():
+                    await urls_queue.put(url)
+        except Exception as e:
+            error = e
+        for _ in range(concurrency):
+            await urls_queue.put(finished)
+        if error is not None:
+            raise error
+
+    async def work():
+        while (url := await urls_queue.get()) is not finished:
+            await results.put(await _batch_item(parser, url))
+        await results.put(finished)
+
+    producer = asyncio.create_task(produce())
+    tasks = [producer] + [asyncio.create_task(work()) for _ in range(concurrency)]
+    running = concurrency
+    try:
+        while running:
+            result = await results.get()
+            if result is finished:
+                running -= 1
+            else:
+                yield result
+        # Ошибка чтения URL
+        await producer
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def run_batch(parser, source, output, concurrency=16):
+    # Читает URL построчно из source, пишет JSONL в output, итоги - в stderr
+    stats = {"ok": 0, "cached": 0, "errors": 0}
+    started = time.perf_counter()
+    await parser.start()
+    try:
+        async for result in parse_batch(parser, source, concurrency):
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            if result["status"] == "ok":
+                stats["ok"] += 1
+                stats["cached"] += result["cached"]
+            else:
+                stats["errors"] += 1
+    finally:
+        await parser.close()
+        output.flush()
+    elapsed = time.perf_counter() - started
+    total = stats["ok"] + stats["errors"]
+    print(f"Обработано {total} URL за {elapsed:.1f} с ({total / elapsed if elapsed else 0:.1f} URL/с): "
+          f"успешно {stats['ok']}, из кэша {stats['cached']}, ошибок {stats['errors']}", file=sys.stderr)
+    return stats
 
 
 if __name__ == "__main__":
@@ -174,5 +980,40 @@ if __name__ == "__main__":
     url9 = 'https://www.avito.ru/ekaterinburg/zemelnye_uchastki/uchastok_5_ga_snt_dnp_4611091619?context=H4sIAAAAAAAA_wEmANn_YToxOntzOjE6IngiO3M6MTY6InRxbFgwQ0R4cEl0Q0NuSmsiO303-IQAJgAAAA'
     url10 = 'https://www.avito.ru/pervouralsk/garazhi_i_mashinomesta/garazh_22_m_4837910861?context=H4sIAAAAAAAA_wEmANn_YToxOntzOjE6IngiO3M6MTY6IlZtNVUyYjdXT3hyQVdxbUciO30bKPsiJgAAAA'
     url11 = 'https://www.avito.ru/ekaterinburg/garazhi_i_mashinomesta/mashinomesto_15_m_4547294076?context=H4sIAAAAAAAA_wEmANn_YToxOntzOjE6IngiO3M6MTY6IjhrOVdjRmdwVmRoMkFtQloiO30uAaclJgAAAA'
-    parser = AvitoParser()
-    print(parser.parse(url0))
\ No newline at end of file
+
+    arg_parser = argparse.ArgumentParser(description="Разбор объявлений Avito")
+    arg_parser.add_argument("command", nargs="?", default="parse", choices=["parse", "reparse", "batch", "search"])
+    arg_parser.add_argument("target", nargs="?", help="URL для parse и search, файл со списком URL для batch (- или пусто: stdin)")
+    arg_parser.add_argument("--cache-dir", default="cache")
+    arg_parser.add_argument("--backend", default="html.parser")
+    arg_parser.add_argument("--workers", type=int, default=None, help="процессов для reparse, по умолчанию все ядра")
+    arg_parser.add_argument("--concurrency", type=int, default=16, help="одновременных загрузок для batch")
+    arg_parser.add_argument("--output", help="файл JSONL для batch и search, по умолчанию stdout")
+    arg_parser.add_argument("--pages", type=int, default=1, help="страниц поисковой выдачи для search")
+    args = arg_parser.parse_args()
+
+    if args.command == "reparse":
+        rebuilt, failed = reparse_archive(args.cache_dir, args.workers, args.backend)
+        print(f"Пересобрано записей: {rebuilt}, с ошибками: {failed}")
+    elif args.command == "search":
+        async def print_search(parser, output):
+            await parser.start()
+            try:
+                async for listing in parser.parse_search(args.target, args.pages):
+                    output.write(json.dumps(listing.to_dict(), ensure_ascii=False) + "\n")
+            finally:
+                await parser.close()
+
+        parser = AvitoParser(cache_dir=args.cache_dir, backend=args.backend)
+        output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+        with output:
+            asyncio.run(print_search(parser, output))
+    elif args.command == "batch":
+        parser = AvitoParser(cache_dir=args.cache_dir, backend=args.backend, archive=True)
+        source = sys.stdin if args.target in (None, "-") else open(args.target, "r", encoding="utf-8")
+        output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+        with source, output:
+            asyncio.run(run_batch(parser, source, output, args.concurrency))
+    else:
+        parser = AvitoParser(cache_dir=args.cache_dir, backend=args.backend, archive=True)
+        print(render_listing(parser.parse(args.target or url0)))
\ No newline at end of file
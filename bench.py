@@ -0,0 +1,574 @@
+""" Замеры производительности парсера на сохранённых страницах.
+Страницы берутся из каталога с файлами *.html: корпус записывается один раз
+командой record, дальше все замеры идут без сети через локальный HTTP-сервер
+"""
+import argparse
+import asyncio
+import glob
+import json
+import multiprocessing
+import os
+import platform
+import random
+import re
+import resource
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bs4 import BeautifulSoup
+
+from avito_parser import AvitoParser, EstateParam, ListingExtractor, render_listing
+from downloader import Downloader
+from fake_telegram import serve_telegram
+
+# По одному объявлению на каждый тип недвижимости
+SAMPLE_URLS = {
+    "flat": 'https://www.avito.ru/ekaterinburg/kvartiry/1-k._kvartira_406_m_69_et._4574477371',
+    "studio": 'https://www.avito.ru/ekaterinburg/kvartiry/kvartira-studiya_57_m_1625_et._7243069890',
+    "free_layout": 'https://www.avito.ru/ekaterinburg/kvartiry/svob._planirovka_50_m_44_et._5122336744',
+    "room": 'https://www.avito.ru/verhnyaya_salda/komnaty/komnata_135_m_v_1-k._45_et._1333252089',
+    "house": 'https://www.avito.ru/verhnee_dubrovo/doma_dachi_kottedzhi/dom_1274_m_na_uchastke_76_sot._7252674869',
+    "dacha": 'https://www.avito.ru/dvurechensk/doma_dachi_kottedzhi/dacha_18_m_na_uchastke_10_sot._3203306502',
+    "cottage": 'https://www.avito.ru/ekaterinburg/doma_dachi_kottedzhi/kottedzh_200_m_na_uchastke_8_sot._3080749310',
+    "townhouse": 'https://www.avito.ru/verhnee_dubrovo/doma_dachi_kottedzhi/taunhaus_134_m_na_uchastke_2_sot._7221450986',
+    "izhs": 'https://www.avito.ru/verhnyaya_pyshma/zemelnye_uchastki/uchastok_6_sot._izhs_1387175700',
+    "snt": 'https://www.avito.ru/ekaterinburg/zemelnye_uchastki/uchastok_5_ga_snt_dnp_4611091619',
+    "garage": 'https://www.avito.ru/pervouralsk/garazhi_i_mashinomesta/garazh_22_m_4837910861',
+    "parking": 'https://www.avito.ru/ekaterinburg/garazhi_i_mashinomesta/mashinomesto_15_m_4547294076',
+}
+STAGES = ("download", "parse", "extract", "render", "cache_write", "cache_read")
+
+
+def record_corpus(pages_dir):
+    # Единственная команда, которая ходит на сайт
+    os.makedirs(pages_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        parser = AvitoParser(cache_dir=cache_dir)
+        for category, url in SAMPLE_URLS.items():
+            path = os.path.join(pages_dir, f"{category}_{parser._get_listing_key(url)}.html")
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(parser._download_html(url))
+            print(f"Сохранено: {path}")
+
+
+def load_pages(pages_dir):
+    pages = {}
+    for path in sorted(glob.glob(os.path.join(pages_dir, "*.html"))):
+        with open(path, "r", encoding="utf-8") as file:
+            pages[os.path.basename(path)] = file.read()
+    if not pages:
+        raise SystemExit(f"В каталоге {pages_dir} нет сохранённых страниц *.html")
+    return pages
+
+
+def _params_old(params_block):
+    # Прежний вариант: повторный разбор блока и отдельный проход на каждый параметр
+    params_soup = BeautifulSoup(params_block.decode_contents(), 'html.parser')
+    values = {}
+    for param in EstateParam:
+        for li in params_soup.find_all('li', class_='params-paramsList__item-_2Y2O'):
+            span = li.find('span', class_='styles-module-noAccent-l9CMS')
+            if span and param.param_name in span.text:
+                values[param] = span.next_sibling.strip()
+                break
+    return values
+
+
+def _params_new(extractor, type_estate, params_block):
+    # Тот же путь, что при разборе страницы: индекс блока и поля схемы этого типа
+    return extractor._collect_params(type_estate, extractor._index_params(params_block))
+
+
+def bench_params(pages, repeat):
+    extractor = ListingExtractor()
+    blocks = []
+    for soup in (BeautifulSoup(html, 'html.parser') for html in pages.values()):
+        if params_block := soup.find('div', {'data-marker': 'item-view/item-params'}):
+            title = soup.find('title')
+            blocks.append((extractor._extract_type_estate(title.text if title else ""), params_block))
+
+    variants = (
+        ("old", lambda type_estate, block: _params_old(block)),
+        ("new", lambda type_estate, block: _params_new(extractor, type_estate, block)),
+    )
+    for name, extract in variants:
+        start = time.process_time()
+        for _ in range(repeat):
+            for type_estate, block in blocks:
+                extract(type_estate, block)
+        elapsed = time.process_time() - start
+        per_page = elapsed / (repeat * len(blocks)) * 1000
+        print(f"params {name}: {per_page:.3f} мс CPU на страницу ({len(blocks)} стр. x {repeat})")
+
+
+BACKENDS = ("html.parser", "lxml")
+
+
+def _run_backend(backend, pages, repeat, results):
+    # Каждый вариант в отдельном процессе, чтобы пиковый RSS не смешивался
+    with tempfile.TemporaryDirectory() as cache_dir:
+        parser = AvitoParser(cache_dir=cache_dir, backend=backend)
+        records = {name: parser._parse_html(html, name).to_dict() for name, html in pages.items()}
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for name, html in pages.items():
+                parser._parse_html(html, name)
+        elapsed = time.perf_counter() - start
+    # ru_maxrss в Linux - килобайты, в macOS - байты
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    max_rss_mb = max_rss / 1024 / 1024 if os.uname().sysname == "Darwin" else max_rss / 1024
+    results.put((parser.backend, repeat * len(pages) / elapsed, max_rss_mb, records))
+
+
+def bench_backends(pages, repeat):
+    results = multiprocessing.Queue()
+    reference = None
+    for backend in BACKENDS:
+        process = multiprocessing.Process(target=_run_backend, args=(backend, pages, repeat, results))
+        process.start()
+        used_backend, pages_per_sec, max_rss_mb, records = results.get()
+        process.join()
+        if reference is None:
+            reference = records
+        mismatched = [name for name in records if records[name] != reference[name]]
+        status = "совпадает" if not mismatched else f"расходится: {', '.join(mismatched)}"
+        print(f"{backend} ({used_backend}): {pages_per_sec:.1f} стр/с, пиковый RSS {max_rss_mb:.1f} МБ, "
+              f"результат {status}")
+
+
+def serve_pages(pages, latency=0.0, throttle=0.0):
+    # Локальная замена Avito: /<что угодно>_<n> отдаёт n-ю страницу корпуса.
+    # throttle - доля запросов, на которые сервер отвечает 429 с Retry-After
+    bodies = [html.encode("utf-8") for html in pages.values()]
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            match = re.search(r'_(\d+)$', self.path.split('?')[0])
+            if not match:
+                self.send_error(404)
+                return
+            self.server.requests += 1
+            if throttle and random.random() < throttle:
+                self.server.throttled += 1
+                self.send_response(429)
+                self.send_header("Retry-After", "1")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            time.sleep(latency)
+            body = bodies[int(match.group(1)) % len(bodies)]
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            # Отдаём по кускам: потоковый режим закрывает соединение, не дочитав страницу
+            try:
+                for start in range(0, len(body), 16 * 1024):
+                    self.wfile.write(body[start:start + 16 * 1024])
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    server.requests = 0
+    server.throttled = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+async def _burst(base_url, count, workers, stream=False, same=False, rate=0):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        downloader = Downloader(rate=rate, burst=max(1, int(rate)))
+        parser = AvitoParser(cache_dir=cache_dir, workers=workers, stream=stream, downloader=downloader)
+        await parser.start()
+
+        async def one(n):
+            start = time.perf_counter()
+            try:
+                await parser.parse_async(f"{base_url}/ekaterinburg/kvartiry/item_{0 if same else n}?context={n}")
+            except Exception:
+                return None
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*(one(n) for n in range(count)))
+        elapsed = time.perf_counter() - start
+        await parser.close()
+
+    errors = latencies.count(None)
+    latencies = [latency * 1000 for latency in latencies if latency is not None] or [0]
+    mode = "stream" if stream else f"workers={workers}"
+    print(f"{mode}: {(count - errors) / elapsed:.1f} стр/с, "
+          f"p50 {statistics.median(latencies):.0f} мс, p95 {_percentile(latencies, 95):.0f} мс, "
+          f"max {max(latencies):.0f} мс, ошибок {errors}, повторов {downloader.stats['retries']}")
+
+
+def bench_burst(pages, count, workers, latency, stream=False, same=False, throttle=0.0, rate=0):
+    # Пачка одновременных сообщений без кэша: разбор в цикле событий против пула процессов
+    # (или против потокового разбора с ранним выходом)
+    server = serve_pages(pages, latency, throttle)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    runs = [(0, False), (0, True)] if stream else [(worker_count, False) for worker_count in sorted({0, workers})]
+    for worker_count, stream_mode in runs:
+        server.requests = server.throttled = 0
+        asyncio.run(_burst(base_url, count, worker_count, stream_mode, same, rate))
+        print(f"  запросов к серверу: {server.requests}, из них отклонено с 429: {server.throttled}")
+    server.shutdown()
+
+
+def _updates(urls, start_id):
+    return [
+        {"update_id": start_id + n, "message": {
+            "message_id": start_id + n, "date": int(time.time()), "text": url,
+            "chat": {"id": 1000 + n % 50, "type": "private"},
+            "from": {"id": 1000 + n % 50, "is_bot": False, "first_name": "bench"},
+        }}
+        for n, url in enumerate(urls)
+    ]
+
+
+async def _post_updates(base_url, updates, secret, concurrency=100):
+    # Как Telegram: не больше concurrency одновременных соединений к webhook
+    import aiohttp
+
+    limit = asyncio.Semaphore(concurrency)
+    async with aiohttp.ClientSession(headers={"X-Telegram-Bot-Api-Secret-Token": secret}) as session:
+        async def post(update):
+            async with limit:
+                async with session.post(base_url, json=update) as response:
+                    await response.read()
+
+        await asyncio.gather(*(post(update) for update in updates))
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _run_bot(telegram, workdir, urls, count, mode, workers):
+    # Бот запускается отдельным процессом как есть; все объявления уже в кэше,
+    # так что замеряется обработка обновлений и ответы, а не загрузка страниц
+    webhook_port = _free_port()
+    secret = "bench-secret"
+    env = {
+        **os.environ,
+        "TOKEN": "123456:bench",
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{telegram.server_address[1]}",
+        "PYTHONPATH": os.path.dirname(os.path.abspath(__file__)),
+        "WEBHOOK_URL": f"http://127.0.0.1:{webhook_port}" if mode == "webhook" else "",
+        "WEBHOOK_PORT": str(webhook_port),
+        "WEBHOOK_SECRET": secret,
+        "WEB_WORKERS": str(workers),
+        "METRICS_PORT": "0",
+        # Замеряется обработка, а не ограничения Telegram: их проверяет режим outbox
+        "TELEGRAM_RATE": "0",
+        "TELEGRAM_CHAT_RATE": "0",
+    }
+    bot_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+    process = subprocess.Popen([sys.executable, bot_path], cwd=workdir, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    webhook = f"http://127.0.0.1:{webhook_port}/webhook"
+    try:
+        if mode == "webhook":
+            # Сокет открывается после setWebhook; ждём, пока он начнёт принимать соединения
+            while True:
+                try:
+                    socket.create_connection(("127.0.0.1", webhook_port), timeout=0.1).close()
+                    break
+                except OSError:
+                    time.sleep(0.05)
+
+        def deliver(batch, start_id):
+            telegram.reset()
+            updates = _updates(batch, start_id)
+            start = time.perf_counter()
+            if mode == "webhook":
+                asyncio.run(_post_updates(webhook, updates, secret))
+            else:
+                telegram.push(updates)
+            if not telegram.wait_replies(len(batch)):
+                raise RuntimeError(f"бот ответил на {telegram.replies} из {len(batch)} сообщений")
+            return time.perf_counter() - start
+
+        # Прогрев: процессы запущены, соединения с API открыты
+        deliver(urls[:max(20, workers * 10)], 1)
+        batch = [urls[n % len(urls)] for n in range(count)]
+        elapsed = deliver(batch, 100000)
+        return count / elapsed, telegram.calls / count
+    finally:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def bench_bot(pages, count, workers):
+    # Сообщений в секунду: long polling в одном процессе против webhook с 1..workers процессами
+    # на локальной замене Bot API
+    telegram = serve_telegram()
+    with tempfile.TemporaryDirectory() as workdir:
+        parser = AvitoParser(cache_dir=os.path.join(workdir, "cache"), downloader=Downloader(rate=0))
+        urls = []
+        for n, html in enumerate(list(pages.values()) * 10):
+            url = f"https://www.avito.ru/ekaterinburg/kvartiry/item_{1000000 + n}"
+            parser.cache.put(parser._get_listing_key(url), parser._parse_html(html, url))
+            urls.append(url)
+
+        runs = [("polling", 1)] + [("webhook", worker_count) for worker_count in sorted({1, workers})]
+        for mode, worker_count in runs:
+            rate, calls = _run_bot(telegram, workdir, urls, count, mode, worker_count)
+            print(f"{mode:<8} процессов {worker_count}: {rate:.0f} сообщений/с, вызовов API на сообщение {calls:.2f}")
+    telegram.shutdown()
+
+
+async def _outbox_run(api_url, count, scheduled):
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiogram.exceptions import TelegramRetryAfter
+    from outbox import NOTIFY, RESULT, Outbox
+
+    bot = Bot("123456:bench", session=AiohttpSession(api=TelegramAPIServer.from_base(api_url)))
+    outbox = Outbox(bot) if scheduled else None
+    if outbox is not None:
+        outbox.start()
+    limit = asyncio.Semaphore(32)
+
+    async def direct(chat_id, text):
+        # Без очереди: отправка сразу, на 429 - пауза retry_after и повтор
+        while True:
+            async with limit:
+                try:
+                    return await bot.send_message(chat_id, text)
+                except TelegramRetryAfter as e:
+                    retry_after = e.retry_after
+            await asyncio.sleep(retry_after)
+
+    async def send(chat_id, text, priority):
+        start = time.perf_counter()
+        if outbox is not None:
+            await outbox.send_message(chat_id, text, priority)
+        else:
+            await direct(chat_id, text)
+        return time.perf_counter() - start
+
+    # Пачка уведомлений /watch в 20 чатов сразу, а на её фоне - ответы на запросы в другие чаты, 10 в секунду
+    start = time.perf_counter()
+    notifications = [asyncio.create_task(send(1 + n % 20, f"notify {n}", NOTIFY)) for n in range(count)]
+    results = []
+    for n in range(max(10, count // 5)):
+        results.append(asyncio.create_task(send(100000 + n, f"result {n}", RESULT)))
+        await asyncio.sleep(0.1)
+    results = await asyncio.gather(*results)
+    await asyncio.gather(*notifications)
+    elapsed = time.perf_counter() - start
+    if outbox is not None:
+        await outbox.stop()
+    await bot.session.close()
+    return results, elapsed
+
+
+def bench_outbox(count):
+    # Очередь отправки против прямых вызовов на замене Bot API с ограничениями Telegram:
+    # 30 вызовов в секунду всего, 1 в секунду в чат (с запасом в один вызов на разброс задержек)
+    for name, scheduled in (("напрямую", False), ("outbox", True)):
+        telegram = serve_telegram(rate=30, burst=6, chat_rate=1, chat_burst=4)
+        results, elapsed = asyncio.run(_outbox_run(f"http://127.0.0.1:{telegram.server_address[1]}", count, scheduled))
+        print(f"{name:<9} ответы p50 {_percentile(results, 50) * 1000:.0f} мс, p95 {_percentile(results, 95) * 1000:.0f} мс; "
+              f"всё доставлено за {elapsed:.1f} с, вызовов API {telegram.calls}, из них 429: {telegram.flooded}")
+        telegram.shutdown()
+
+
+def _stage_summary(timings, memory):
+    timings = sorted(timings)
+    return {
+        "p50_ms": round(statistics.median(timings) * 1000, 3),
+        "p95_ms": round(_percentile(timings, 95) * 1000, 3),
+        "p99_ms": round(_percentile(timings, 99) * 1000, 3),
+        "pages_per_sec": round(len(timings) / sum(timings), 1) if sum(timings) else None,
+        "peak_kb": round(max(peak for peak, _ in memory) / 1024, 1),
+        "allocated_blocks": max(blocks for _, blocks in memory),
+    }
+
+
+async def _run_stages(parser, base_url, pages, repeat, trace):
+    # Прогоняет каждую страницу по этапам. Без trace - время этапов,
+    # с trace - пик памяти и число выделенных блоков на этапе (tracemalloc замедляет работу,
+    # поэтому время и память меряются разными проходами)
+    results = {stage: [] for stage in STAGES}
+
+    def measure(stage, started, blocks):
+        if trace:
+            _, peak = tracemalloc.get_traced_memory()
+            results[stage].append((peak - started, sys.getallocatedblocks() - blocks))
+            tracemalloc.reset_peak()
+        else:
+            results[stage].append(time.perf_counter() - started)
+
+    def mark():
+        if trace:
+            tracemalloc.reset_peak()
+            return tracemalloc.get_traced_memory()[0], sys.getallocatedblocks()
+        return time.perf_counter(), 0
+
+    for _ in range(repeat):
+        for index in range(len(pages)):
+            url = f"{base_url}/bench/page_{index}"
+            key = parser._get_listing_key(url)
+
+            started, blocks = mark()
+            html = await parser._download_html_async(url)
+            measure("download", started, blocks)
+
+            started, blocks = mark()
+            soup = parser._make_soup(html)
+            measure("parse", started, blocks)
+
+            started, blocks = mark()
+            listing = parser._extract_listing(soup, url)
+            measure("extract", started, blocks)
+
+            started, blocks = mark()
+            render_listing(listing)
+            measure("render", started, blocks)
+
+            started, blocks = mark()
+            parser.cache.put(key, listing)
+            measure("cache_write", started, blocks)
+
+            # Чтение с диска: убираем запись из памяти, чтобы пройти оба уровня
+            parser.cache.memory.discard(key)
+            started, blocks = mark()
+            parser.cache.get(key)
+            measure("cache_read", started, blocks)
+    return results
+
+
+async def _suite(base_url, pages, repeat, backend):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        parser = AvitoParser(cache_dir=cache_dir, backend=backend, downloader=Downloader(rate=0))
+        await parser.start()
+        # Прогрев: соединения, импорты, создание таблиц
+        await _run_stages(parser, base_url, pages, 1, trace=False)
+        timings = await _run_stages(parser, base_url, pages, repeat, trace=False)
+        tracemalloc.start()
+        memory = await _run_stages(parser, base_url, pages, 1, trace=True)
+        tracemalloc.stop()
+        await parser.close()
+    return {stage: _stage_summary(timings[stage], memory[stage]) for stage in STAGES}, timings
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def bench_suite(pages, repeat, latency, backend, output=None, compare=None):
+    server = serve_pages(pages, latency)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    stages, timings = asyncio.run(_suite(base_url, pages, repeat, backend))
+    server.shutdown()
+
+    totals = [sum(timings[stage][n] for stage in STAGES) for n in range(len(timings["download"]))]
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "backend": backend,
+            "latency_ms": latency * 1000,
+            "pages": len(pages),
+            "repeat": repeat,
+        },
+        "stages": stages,
+        "total": {
+            "p50_ms": round(statistics.median(totals) * 1000, 3),
+            "p95_ms": round(_percentile(totals, 95) * 1000, 3),
+            "p99_ms": round(_percentile(totals, 99) * 1000, 3),
+            "pages_per_sec": round(len(totals) / sum(totals), 1),
+        },
+    }
+
+    previous = None
+    if compare:
+        with open(compare, "r", encoding="utf-8") as file:
+            previous = json.load(file)
+    print(f"{'этап':<12} {'p50 мс':>9} {'p95 мс':>9} {'p99 мс':>9} {'стр/с':>9} {'пик КБ':>9} {'блоков':>8}")
+    for stage, summary in [*stages.items(), ("total", report["total"])]:
+        line = (f"{stage:<12} {summary['p50_ms']:>9.2f} {summary['p95_ms']:>9.2f} {summary['p99_ms']:>9.2f} "
+                f"{summary['pages_per_sec'] or 0:>9.1f} {summary.get('peak_kb', ''):>9} "
+                f"{summary.get('allocated_blocks', ''):>8}")
+        if previous is not None:
+            old = previous["total"] if stage == "total" else previous["stages"].get(stage)
+            if old and old["p50_ms"]:
+                line += f"   p50 {(summary['p50_ms'] / old['p50_ms'] - 1) * 100:+.1f}%"
+        print(line)
+
+    if output:
+        with open(output, "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        print(f"Результаты записаны в {output}")
+    return report
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("mode", choices=["record", "suite", "params", "burst", "backends", "bot", "outbox"])
+    arg_parser.add_argument("pages_dir", nargs="?", default="bench_corpus")
+    arg_parser.add_argument("--repeat", type=int, default=50)
+    arg_parser.add_argument("--count", type=int, default=100, help="размер пачки сообщений для burst, bot и outbox")
+    arg_parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                            help="процессов пула для burst, процессов webhook для bot")
+    arg_parser.add_argument("--latency", type=float, default=0.05, help="задержка ответа сервера, с")
+    arg_parser.add_argument("--stream", action="store_true", help="сравнить burst с потоковым разбором")
+    arg_parser.add_argument("--same", action="store_true",
+                            help="вся пачка burst - одно объявление (проверка объединения запросов)")
+    arg_parser.add_argument("--throttle", type=float, default=0.0,
+                            help="доля ответов 429 от локального сервера в burst (проверка повторов)")
+    arg_parser.add_argument("--rate", type=float, default=0,
+                            help="ограничение запросов в секунду к хосту в burst, 0 - без ограничения")
+    arg_parser.add_argument("--backend", default="html.parser", help="движок разбора для suite")
+    arg_parser.add_argument("--output", help="куда записать результаты suite в JSON")
+    arg_parser.add_argument("--compare", help="JSON прошлого запуска suite для сравнения")
+    args = arg_parser.parse_args()
+
+    if args.mode == "record":
+        record_corpus(args.pages_dir)
+        raise SystemExit
+    if args.mode == "outbox":
+        bench_outbox(args.count)
+        raise SystemExit
+
+    pages = load_pages(args.pages_dir)
+    if args.mode == "suite":
+        bench_suite(pages, args.repeat, args.latency, args.backend, args.output, args.compare)
+    elif args.mode == "params":
+        bench_params(pages, args.repeat)
+    elif args.mode == "backends":
+        bench_backends(pages, args.repeat)
+    elif args.mode == "bot":
+        bench_bot(pages, args.count, args.workers)
+    else:
+        bench_burst(pages, args.count, args.workers, args.latency, args.stream, args.same, args.throttle, args.rate)
@@ -1,48 +1,389 @@
+import asyncio
+import html
 import logging
+import multiprocessing
+import os
+import re
+import socket
+import time
+from aiohttp import web
 from aiogram import Bot, Dispatcher, types
 from aiogram.enums import ParseMode
 from aiogram.filters import Command
 from aiogram.types import Message
 from aiogram.client.default import DefaultBotProperties
-from avito_parser import AvitoParser
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from avito_parser import AvitoParser, render_listing
+from downloader import DownloadError, Downloader
 from loadenv import envi
+from market import MarketIndex, format_report
+from metrics import SamplingProfiler, start_metrics_server
+from outbox import NOTIFY, Outbox
+from watchlist import Watcher, WatchStore
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
-parser = AvitoParser()
+parser = AvitoParser(
+    workers=envi.parse_workers,
+    backend=envi.parse_backend,
+    stream=envi.parse_stream,
+    cache_ttl=envi.cache_ttl,
+    cache_stale_ttl=envi.cache_stale_ttl,
+    cache_max_entries=envi.cache_max_entries,
+    cache_max_bytes=envi.cache_max_bytes,
+    archive=envi.archive_pages,
+    archive_keep=envi.archive_keep,
+    downloader=Downloader(
+        rate=envi.rate_limit,
+        burst=envi.rate_burst,
+        retries=envi.http_retries,
+        connect_timeout=envi.connect_timeout,
+        read_timeout=envi.read_timeout,
+    ),
+)
 
 # Инициализация бота и диспетчера
 bot = Bot(
     token=envi.token,
+    session=AiohttpSession(api=TelegramAPIServer.from_base(envi.telegram_api)) if envi.telegram_api else None,
     default=DefaultBotProperties(parse_mode=ParseMode.HTML)  # Указываем parse_mode здесь
 )
 dp = Dispatcher()
+# Все ответы бота идут через одну очередь с ограничениями Telegram; в режиме webhook
+# общий лимит делится между процессами
+outbox = Outbox(
+    bot,
+    rate=envi.telegram_rate / (envi.web_workers if envi.webhook_url else 1),
+    chat_rate=envi.telegram_chat_rate,
+    metrics=parser.metrics,
+)
+metrics_runner = None
+# Номер процесса в режиме webhook: у каждого свой порт метрик
+worker_index = 0
+
+
+async def notify_watchers(chat_ids, url, listing, changes):
+    link = f'<a href="{html.escape(url)}">🔗 Переход на объявление</a>'
+    if listing is None:
+        text = f"🔔 Объявление снято с публикации\n{link}"
+    else:
+        text = f"🔔 <b>{listing.type_estate}</b>: есть изменения\n" + "\n".join(changes) + f"\n{link}"
+    # Уведомления уступают очередь ответам на запросы
+    results = await asyncio.gather(
+        *(outbox.send_message(chat_id, text, NOTIFY, disable_web_page_preview=True) for chat_id in chat_ids),
+        return_exceptions=True,
+    )
+    for chat_id, result in zip(chat_ids, results):
+        if isinstance(result, Exception):
+            logger.error(f"Не удалось отправить уведомление в чат {chat_id}: {result}")
+
+# Столбцы для /market, дополняются из кэша перед каждым отчётом
+market = MarketIndex()
+
+# Подписки хранятся рядом с кэшем; проверяет их только один процесс (см. on_startup)
+watcher = Watcher(
+    WatchStore(os.path.join(parser.cache_dir, "watches.sqlite3")),
+    parser,
+    notify_watchers,
+    interval=envi.watch_interval,
+    min_interval=envi.watch_min_interval,
+    max_interval=envi.watch_max_interval,
+    concurrency=envi.watch_concurrency,
+)
+
+# Ограничение Telegram на длину одного сообщения
+MESSAGE_LIMIT = 4096
+# Слева от ссылки - не часть другого адреса: ни notavito.ru, ни example.com/avito.ru/...
+AVITO_URL_RE = re.compile(r'(?<![\w.@/-])(?:https?://)?(?:www\.|m\.)?avito\.ru/[^\s<>"\']+')
+
+# Ответ в чат сообщения через общую очередь отправки
+async def answer(message: Message, text, **kwargs):
+    return await outbox.send_message(message.chat.id, text, **kwargs)
 
 # Обработчик команды /start
 @dp.message(Command("start"))
 async def cmd_start(message: Message):
-    await message.answer("Привет! Отправь мне URL объявления с Avito, и я покажу тебе информацию о нём.")
+    await answer(message, "Привет! Отправь мне URL объявления с Avito, и я покажу тебе информацию о нём.")
 
-# Обработчик текстовых сообщений
-@dp.message()
-async def handle_message(message: Message):
-    url = message.text
-    if "avito.ru" in url:
-        await message.answer("Обрабатываю запрос...")
+def is_admin(message: Message):
+    return message.from_user is not None and message.from_user.id in envi.admin_ids
+
+# Статистика этапов обработки, кэша и загрузок - только для администраторов
+@dp.message(Command("stats"))
+async def cmd_stats(message: Message):
+    if not is_admin(message):
+        await answer(message, "Команда доступна только администраторам.")
+        return
+    cache = parser.cache.snapshot()
+    downloads = parser.downloader.stats
+    lines = parser.metrics.summary() or ["Запросов ещё не было"]
+    lines.append(f"кэш: из памяти {cache['memory_hits']}, с диска {cache['disk_hits']}, "
+                 f"устаревших {cache['stale_hits']}, промахов {cache['misses']}, "
+                 f"доля попаданий {parser.cache.hit_ratio():.1%}")
+    lines.append(f"загрузки: запросов {downloads['requests']}, повторов {downloads['retries']}, "
+                 f"ограничений доступа {downloads['throttled']}")
+    text = "\n".join(lines)
+    await answer(message, f"<pre>{html.escape(text)}</pre>")
+
+# Профиль одного запроса: страница загружается заново, минуя кэш
+@dp.message(Command("profile"))
+async def cmd_profile(message: Message):
+    if not is_admin(message):
+        await answer(message, "Команда доступна только администраторам.")
+        return
+    url = (message.text or "").partition(" ")[2].strip()
+    if "avito.ru" not in url:
+        await answer(message, "Использование: /profile URL объявления")
+        return
+    start = time.perf_counter()
+    with SamplingProfiler() as profiler:
         try:
-            response = (f'{parser.parse(url)}\n<a href="{url}">🔗 Переход на объявление</a>')
-            await message.answer(str(response), disable_web_page_preview=True)
+            await parser.parse_async(url, use_cache=False)
         except Exception as e:
-            logger.error(f"Ошибка при парсинге: {e}")
-            await message.answer("Произошла ошибка при обработке запроса. Попробуйте ещё раз.")
+            logger.error(f"Ошибка при профилировании {url}: {e}")
+    lines = [f"{(time.perf_counter() - start) * 1000:.0f} мс, снимков стека: {profiler.samples}"]
+    lines += [f"{share:5.1%} {line}" for line, share in profiler.top(15)]
+    text = "\n".join(lines)
+    await answer(message, f"<pre>{html.escape(text)}</pre>")
+
+def extract_urls(message: Message):
+    # Ссылки из текста и из разметки сообщения (в том числе скрытые под текстом),
+    # по одной на объявление и в порядке появления
+    text = message.text or message.caption or ""
+    found = AVITO_URL_RE.findall(text)
+    for entity in message.entities or message.caption_entities or []:
+        if entity.type == "text_link":
+            found.append(entity.url)
+        elif entity.type == "url":
+            found.append(entity.extract_from(text))
+
+    urls = {}
+    for url in found:
+        if not AVITO_URL_RE.fullmatch(url or ""):
+            continue
+        url = url.rstrip('.,;:!?)]»')
+        if not url.startswith("http"):
+            url = "https://" + url
+        urls.setdefault(parser._get_listing_key(url), url)
+    return list(urls.values())
+
+
+def command_url(message: Message):
+    # URL после команды: "/watch https://www.avito.ru/..."
+    urls = extract_urls(message)
+    return urls[0] if urls else None
+
+
+# Подписка на изменения цены и параметров объявления
+@dp.message(Command("watch"))
+async def cmd_watch(message: Message):
+    url = command_url(message)
+    if url is None:
+        await answer(message, "Использование: /watch URL объявления")
+        return
+    try:
+        listing = await parser.parse_async(url)
+        # Снимок для сравнения нужен полный, а не из поисковой выдачи
+        if listing.partial:
+            listing = await parser.parse_async(url, use_cache=False)
+    except Exception as e:
+        logger.error(f"Ошибка при парсинге {url}: {e}")
+        await answer(message, error_text(e))
+        return
+    await watcher.watch(message.chat.id, listing)
+    await answer(message, f"🔔 Слежу за объявлением: {listing.type_estate}, {listing.price_value}₽. "
+                          f"Сообщу, если изменится цена или параметры.")
+
+@dp.message(Command("unwatch"))
+async def cmd_unwatch(message: Message):
+    url = command_url(message)
+    if url is None:
+        await answer(message, "Использование: /unwatch URL объявления")
+        return
+    if watcher.store.remove(message.chat.id, parser._get_listing_key(url)):
+        await answer(message, "Подписка отменена.")
     else:
-        await message.answer("Пожалуйста, отправьте корректный URL объявления с Avito.")
+        await answer(message, "Подписки на это объявление не было.")
+
+@dp.message(Command("watches"))
+async def cmd_watches(message: Message):
+    watched = watcher.store.by_chat(message.chat.id)
+    if not watched:
+        await answer(message, "Подписок нет. Добавить: /watch URL объявления")
+        return
+    lines = [f'{n}. <a href="{html.escape(url)}">{listing_id}</a>' for n, (listing_id, url) in enumerate(watched, 1)]
+    for text in pack_messages(line + "\n" for line in lines):
+        await answer(message, text, disable_web_page_preview=True)
+
+
+# Рыночная сводка по всем закэшированным объявлениям: /market [тип] [город]
+@dp.message(Command("market"))
+async def cmd_market(message: Message):
+    market.sync(parser.cache.disk)
+    query = (message.text or "").partition(" ")[2].strip()
+    # Тип может состоять из нескольких слов ("Свободная планировка"), остаток - город из URL
+    type_estate = next((name for name in market.types if query.lower().startswith(name.lower())), None)
+    city = query[len(type_estate):].strip() if type_estate else query
+    by = "city" if type_estate and not city else "type"
+    with parser.metrics.stage("market"):
+        report = market.report(type_estate, city or None, by)
+    if not report[0][1]["count"]:
+        await answer(message, "Нет объявлений для такой выборки. Пример: /market Квартира ekaterinburg")
+        return
+    await answer(message, html.escape(format_report(report, by)))
+
+
+def error_text(e):
+    if isinstance(e, DownloadError):
+        if e.throttled:
+            return "Avito временно ограничил запросы. Попробуйте ещё раз через минуту."
+        return "Не удалось загрузить объявление. Попробуйте ещё раз."
+    return "Произошла ошибка при обработке запроса. Попробуйте ещё раз."
+
+
+async def parse_urls(urls):
+    # Все объявления сообщения загружаются одновременно, не больше message_concurrency сразу.
+    # Ошибка одного объявления не мешает остальным
+    limit = asyncio.Semaphore(envi.message_concurrency)
+
+    async def parse_one(url):
+        async with limit:
+            try:
+                return url, await parser.parse_async(url), None
+            except Exception as e:
+                parser.metrics.inc("download_errors" if isinstance(e, DownloadError) else "errors")
+                logger.error(f"Ошибка при парсинге {url}: {e}")
+                return url, None, e
+
+    return await asyncio.gather(*(parse_one(url) for url in urls))
+
+
+def pack_messages(parts, limit=MESSAGE_LIMIT):
+    # Склеивает ответы по объявлениям в как можно меньшее число сообщений не длиннее limit
+    messages = []
+    current = ""
+    for part in parts:
+        if current and len(current) + len(part) > limit:
+            messages.append(current)
+            current = ""
+        current += part
+    if current:
+        messages.append(current)
+    return messages
+
+
+# Обработчик текстовых сообщений
+@dp.message()
+async def handle_message(message: Message):
+    urls = extract_urls(message)
+    if not urls:
+        await answer(message, "Пожалуйста, отправьте корректный URL объявления с Avito.")
+        return
+
+    skipped = len(urls) - envi.max_message_urls
+    urls = urls[:envi.max_message_urls]
+    with parser.metrics.stage("total"):
+        parsing = asyncio.ensure_future(parse_urls(urls))
+        # Заглушка нужна, только если ответ готовится дольше progress_delay; потом её заменит ответ
+        progress = None
+        if not (await asyncio.wait({parsing}, timeout=envi.progress_delay))[0]:
+            progress = outbox.progress(
+                message.chat.id,
+                "Обрабатываю запрос..." if len(urls) == 1 else f"Обрабатываю объявлений: {len(urls)}...",
+            )
+        results = await parsing
+        with parser.metrics.stage("render"):
+            parts = []
+            for url, listing, error in results:
+                if error is None:
+                    parts.append(f'{render_listing(listing)}\n<a href="{html.escape(url)}">🔗 Переход на объявление</a>\n\n')
+                else:
+                    parts.append(f'⚠️ <a href="{html.escape(url)}">{html.escape(url)}</a>\n{error_text(error)}\n\n')
+            if skipped > 0:
+                parts.append(f"Обработаны первые {len(urls)} ссылок, ещё {skipped} пропущено.")
+        with parser.metrics.stage("send"):
+            await outbox.reply(message.chat.id, pack_messages(parts), progress, disable_web_page_preview=True)
+
+# Общая HTTP-сессия парсера живёт всё время работы бота
+async def on_startup():
+    global metrics_runner
+    await parser.start()
+    outbox.start()
+    logger.info(f"Кэш: удалено истёкших записей {parser.cache.sweep()}")
+    if parser.archive is not None:
+        logger.info(f"Архив страниц: удалено лишних файлов {parser.archive.sweep()}")
+    logger.info(f"Рыночная сводка: прочитано изменений {market.sync(parser.cache.disk)}")
+    # В режиме webhook подписки проверяет только первый процесс
+    if worker_index == 0:
+        watcher.start()
+    if envi.metrics_port:
+        port = envi.metrics_port + worker_index
+        metrics_runner = await start_metrics_server(parser.export_metrics, port)
+        logger.info(f"Метрики Prometheus: http://127.0.0.1:{port}/metrics")
+
+async def on_shutdown():
+    downloads = parser.downloader.stats
+    logger.info(f"Загрузка: запросов {downloads['requests']}, повторов {downloads['retries']}, "
+                f"ограничений доступа {downloads['throttled']}")
+    stats = parser.cache.snapshot()
+    logger.info(f"Кэш: из памяти {stats['memory_hits']}, с диска {stats['disk_hits']}, "
+                f"устаревших {stats['stale_hits']}, промахов {stats['misses']}, "
+                f"вытеснено {stats['evictions']}, "
+                f"доля попаданий {parser.cache.hit_ratio():.1%}")
+    await watcher.stop()
+    await outbox.stop()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+    await parser.close()
+
+dp.startup.register(on_startup)
+dp.shutdown.register(on_shutdown)
 
 # Запуск бота
 async def main():
     await dp.start_polling(bot)
 
+async def set_webhook():
+    await bot.set_webhook(
+        envi.webhook_url.rstrip("/") + envi.webhook_path,
+        secret_token=envi.webhook_secret,
+        max_connections=100,
+    )
+    await bot.session.close()
+
+def run_webhook_worker(sock, index):
+    # Процесс принимает обновления с общего сокета; кэш на диске общий для всех процессов
+    global worker_index
+    worker_index = index
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=envi.webhook_secret).register(app, path=envi.webhook_path)
+    setup_application(app, dp, bot=bot)
+    web.run_app(app, sock=sock, print=None, access_log=None)
+
+def run_webhook():
+    # Сокет открывается один раз, процессы-обработчики наследуют его и принимают соединения по очереди
+    asyncio.run(set_webhook())
+    sock = socket.create_server((envi.webhook_host, envi.webhook_port), backlog=1024)
+    workers = [
+        multiprocessing.Process(target=run_webhook_worker, args=(sock, index))
+        for index in range(envi.web_workers)
+    ]
+    for worker in workers:
+        worker.start()
+    logger.info(f"Webhook: {envi.web_workers} процессов на {envi.webhook_host}:{envi.webhook_port}{envi.webhook_path}")
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        # Ctrl+C получают и процессы-обработчики, ждём их корректного завершения
+        for worker in workers:
+            worker.join()
+
 if __name__ == '__main__':
-    import asyncio
-    asyncio.run(main())
\ No newline at end of file
+    if envi.webhook_url:
+        run_webhook()
+    else:
+        asyncio.run(main())
\ No newline at end of file
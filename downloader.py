@@ -0,0 +1,226 @@
+""" Загрузка страниц: общий пул соединений, ограничение частоты запросов
+к каждому хосту (token bucket), повторы с экспоненциальной задержкой и джиттером,
+учёт заголовка Retry-After и таймауты на соединение и чтение
+"""
+import asyncio
+import contextlib
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+}
+# Ответы, после которых есть смысл повторить запрос
+RETRY_STATUSES = {403, 429, 500, 502, 503, 504}
+
+
+class DownloadError(Exception):
+    def __init__(self, status, url=None):
+        super().__init__(f"Ошибка при загрузке страницы: {status or 'нет ответа'}")
+        self.status = status
+        self.url = url
+
+    @property
+    def throttled(self):
+        # Сайт ограничил частоту запросов или временно закрыл доступ
+        return self.status in (403, 429)
+
+
+class TokenBucket:
+    # rate токенов в секунду, не больше burst подряд. Токен берётся сразу, а при нехватке
+    # вызывающий ждёт своей очереди: запросы выстраиваются равномерно, а не пачкой
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        # Возвращает, сколько секунд подождать перед запросом
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.paused_until - now)
+
+    def ready_in(self):
+        # Сколько секунд до свободного токена, не занимая его
+        with self._lock:
+            now = time.monotonic()
+            tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            wait = (1 - tokens) / self.rate if tokens < 1 else 0.0
+            return max(wait, self.paused_until - now)
+
+    def pause(self, seconds):
+        # Retry-After: до этого момента к хосту не обращается никто
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        if (wait := self.reserve()) > 0:
+            await asyncio.sleep(wait)
+
+    def acquire_sync(self):
+        if (wait := self.reserve()) > 0:
+            time.sleep(wait)
+
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class Downloader:
+    def __init__(self, rate=3.0, burst=5, retries=3, backoff=0.5, max_backoff=30.0,
+                 connect_timeout=5.0, read_timeout=20.0, pool_size=100, pool_per_host=20):
+        # rate=0 отключает ограничение частоты (например, для локального стенда)
+        self.rate = rate
+        self.burst = burst
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_size = pool_size
+        self.pool_per_host = pool_per_host
+        self.session = None
+        self._buckets = {}
+        self._buckets_lock = threading.Lock()
+        self._sync_session = None
+        self.stats = {"requests": 0, "retries": 0, "throttled": 0}
+
+    def _bucket(self, url):
+        if not self.rate:
+            return None
+        host = urlsplit(url).netloc
+        with self._buckets_lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(self.rate, self.burst)
+            return self._buckets[host]
+
+    def _delay(self, attempt, retry_after=None):
+        # Full jitter: случайная задержка от 0 до backoff * 2^attempt
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def _should_retry(self, status, attempt, url):
+        self.stats["requests"] += 1
+        if status in (403, 429):
+            self.stats["throttled"] += 1
+        # status None - ошибка сети или таймаут, их тоже повторяем
+        if (status is not None and status not in RETRY_STATUSES) or attempt == self.retries:
+            raise DownloadError(status, url)
+        self.stats["retries"] += 1
+
+    async def start(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size, limit_per_host=self.pool_per_host, keepalive_timeout=60
+            )
+            timeout = aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout)
+            self.session = aiohttp.ClientSession(headers=HEADERS, connector=connector, timeout=timeout)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        if self._sync_session is not None:
+            self._sync_session.close()
+            self._sync_session = None
+
+    @contextlib.asynccontextmanager
+    async def open(self, url):
+        # Отдаёт ответ 200 с непрочитанным телом; повторяет запрос при ошибках сети
+        # и ответах из RETRY_STATUSES
+        if self.session is None:
+            await self.start()
+        bucket = self._bucket(url)
+        for attempt in range(self.retries + 1):
+            if bucket is not None:
+                await bucket.acquire()
+            try:
+                response = await self.session.get(url)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                self._should_retry(None, attempt, url)
+                await asyncio.sleep(self._delay(attempt))
+                continue
+            if response.status == 200:
+                self.stats["requests"] += 1
+                try:
+                    yield response
+                finally:
+                    response.release()
+                return
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            response.release()
+            self._should_retry(response.status, attempt, url)
+            if retry_after is not None and bucket is not None:
+                bucket.pause(retry_after)
+            await asyncio.sleep(self._delay(attempt, retry_after))
+
+    async def fetch_text(self, url):
+        async with self.open(url) as response:
+            return await response.text()
+
+    def _get_sync_session(self):
+        with self._buckets_lock:
+            return self._sync_session or self._make_sync_session()
+
+    def _make_sync_session(self):
+        if self._sync_session is None:
+            session = requests.Session()
+            session.headers.update(HEADERS)
+            adapter = HTTPAdapter(pool_connections=self.pool_per_host, pool_maxsize=self.pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._sync_session = session
+        return self._sync_session
+
+    @contextlib.contextmanager
+    def open_sync(self, url):
+        session = self._get_sync_session()
+        bucket = self._bucket(url)
+        for attempt in range(self.retries + 1):
+            if bucket is not None:
+                bucket.acquire_sync()
+            try:
+                response = session.get(url, stream=True, timeout=(self.connect_timeout, self.read_timeout))
+            except (requests.ConnectionError, requests.Timeout):
+                self._should_retry(None, attempt, url)
+                time.sleep(self._delay(attempt))
+                continue
+            if response.status_code == 200:
+                self.stats["requests"] += 1
+                with response:
+                    yield response
+                return
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            response.close()
+            self._should_retry(response.status_code, attempt, url)
+            if retry_after is not None and bucket is not None:
+                bucket.pause(retry_after)
+            time.sleep(self._delay(attempt, retry_after))
+
+    def fetch_text_sync(self, url):
+        with self.open_sync(url) as response:
+            return response.text
@@ -0,0 +1,115 @@
+""" Локальная замена Bot API для замеров бота и тестов очереди отправки:
+настоящий aiogram.Bot ходит к ней по HTTP вместо api.telegram.org
+"""
+import itertools
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from downloader import TokenBucket
+
+
+def serve_telegram(rate=0, burst=1, chat_rate=0, chat_burst=1):
+    # Локальная замена Bot API: getUpdates отдаёт накопленные обновления (long polling до 1 с),
+    # sendMessage и editMessageText только считаются. Ответ на запрос - правка заглушки или
+    # сообщение, которое не начинается с "Обрабатываю". С rate/chat_rate сервер, как Telegram,
+    # отвечает 429 с retry_after на вызовы сверх ограничения (всего и в один чат)
+    class Handler(BaseHTTPRequestHandler):
+        # keep-alive: бот держит пул соединений с API, как с настоящим Telegram
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            fields = parse_qs(self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode("utf-8"))
+            method = self.path.rsplit("/", 1)[-1]
+            if method == "getUpdates":
+                body = {"ok": True, "result": self.server.take_updates()}
+            elif method == "getMe":
+                body = {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}}
+            elif method in ("sendMessage", "editMessageText"):
+                body = self.server.message(method, fields)
+            else:
+                body = {"ok": True, "result": True}
+            body = json.dumps(body).encode("utf-8")
+            self.send_response(200 if body.startswith(b'{"ok": true') else 429)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                # Бот остановлен посреди long polling
+                pass
+
+        do_GET = do_POST
+
+        def log_message(self, format, *args):
+            pass
+
+    class TelegramServer(ThreadingHTTPServer):
+        daemon_threads = True
+
+        def __init__(self):
+            super().__init__(("127.0.0.1", 0), Handler)
+            self.updates = []
+            self.changed = threading.Condition()
+            self._global = TokenBucket(rate, burst) if rate else None
+            self._chats = {}
+            self.reset()
+
+        def reset(self):
+            with self.changed:
+                self.calls = self.replies = self.edits = self.flooded = 0
+                self._message_ids = itertools.count(1)
+
+        def push(self, updates):
+            with self.changed:
+                self.updates.extend(updates)
+                self.changed.notify_all()
+
+        def take_updates(self):
+            with self.changed:
+                self.changed.wait_for(lambda: self.updates, timeout=1.0)
+                taken, self.updates = self.updates[:100], self.updates[100:]
+                return taken
+
+        def _limited(self, chat_id):
+            # Вызов сверх ограничения не расходует токен, как и у Telegram
+            buckets = [self._global] if self._global is not None else []
+            if chat_rate:
+                buckets.append(self._chats.setdefault(chat_id, TokenBucket(chat_rate, chat_burst)))
+            wait = max((bucket.ready_in() for bucket in buckets), default=0.0)
+            if wait <= 0:
+                for bucket in buckets:
+                    bucket.reserve()
+            return wait
+
+        def message(self, method, fields):
+            chat_id = int(fields.get("chat_id", ["0"])[0])
+            text = fields.get("text", [""])[0]
+            with self.changed:
+                self.calls += 1
+                if (wait := self._limited(chat_id)) > 0:
+                    self.flooded += 1
+                    return {"ok": False, "error_code": 429, "description": "Too Many Requests",
+                            "parameters": {"retry_after": max(1, math.ceil(wait))}}
+                if method == "editMessageText":
+                    self.edits += 1
+                    message_id = int(fields["message_id"][0])
+                else:
+                    message_id = next(self._message_ids)
+                if method == "editMessageText" or not text.startswith("Обрабатываю"):
+                    self.replies += 1
+                    self.changed.notify_all()
+            return {"ok": True, "result": {"message_id": message_id, "date": int(time.time()),
+                                           "chat": {"id": chat_id, "type": "private"}, "text": text}}
+
+        def wait_replies(self, count, timeout=120):
+            with self.changed:
+                return self.changed.wait_for(lambda: self.replies >= count, timeout=timeout)
+
+    server = TelegramServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,138 @@
+""" Архив исходных страниц объявлений. Страница хранится сжатой под своим
+SHA-256 (одинаковые страницы - один файл), индекс SQLite связывает объявление
+со страницами. Из архива записи кэша пересобираются без обращения к сайту,
+когда меняются правила извлечения
+"""
+import contextlib
+import gzip
+import hashlib
+import os
+import tempfile
+import time
+
+from sqlite_local import LocalConnection
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODEC_EXTENSIONS = {"zstd": ".html.zst", "gzip": ".html.gz"}
+
+
+def _compress(data, codec):
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def _decompress(data, codec):
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def blob_path(root, sha256, codec):
+    return os.path.join(root, sha256[:2], sha256 + CODEC_EXTENSIONS[codec])
+
+
+def read_page(root, sha256, codec):
+    # Без обращения к индексу: удобно вызывать в процессах пула
+    with open(blob_path(root, sha256, codec), "rb") as file:
+        return _decompress(file.read(), codec).decode("utf-8")
+
+
+class HtmlArchive:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS pages (
+            listing_id TEXT NOT NULL,
+            sha256 TEXT NOT NULL,
+            codec TEXT NOT NULL,
+            url TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            PRIMARY KEY (listing_id, sha256)
+        );
+        CREATE INDEX IF NOT EXISTS pages_fetched_at ON pages (listing_id, fetched_at);
+        CREATE INDEX IF NOT EXISTS pages_sha256 ON pages (sha256);
+    """
+
+    def __init__(self, root, keep=3):
+        # keep - сколько последних страниц хранить для каждого объявления
+        self.root = root
+        self.keep = keep
+        self.codec = "zstd" if zstandard is not None else "gzip"
+        os.makedirs(self.root, exist_ok=True)
+        self._connect = LocalConnection(os.path.join(root, "index.sqlite3"))
+        self._connect().executescript(self.SCHEMA)
+
+    def put(self, listing_id, url, html, fetched_at=None):
+        data = html.encode("utf-8")
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = blob_path(self.root, sha256, self.codec)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Пишем во временный файл и переименовываем: читатель не увидит половину файла
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as file:
+                file.write(_compress(data, self.codec))
+            os.replace(tmp_path, path)
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)",
+                (listing_id, sha256, self.codec, url, fetched_at or time.time()),
+            )
+            dropped = self._trim(connection, listing_id)
+        self._remove_unreferenced(connection, dropped)
+        return sha256
+
+    def _trim(self, connection, listing_id):
+        # Удаляет из индекса страницы объявления сверх keep последних
+        dropped = connection.execute(
+            "SELECT sha256, codec FROM pages WHERE listing_id = ? ORDER BY fetched_at DESC LIMIT -1 OFFSET ?",
+            (listing_id, self.keep),
+        ).fetchall()
+        connection.executemany(
+            "DELETE FROM pages WHERE listing_id = ? AND sha256 = ?",
+            [(listing_id, sha256) for sha256, _ in dropped],
+        )
+        return dropped
+
+    def _remove_unreferenced(self, connection, pages):
+        # Одинаковые страницы разных объявлений лежат в одном файле: удаляем его,
+        # только когда на него не ссылается ни одна запись индекса
+        removed = 0
+        for sha256, codec in pages:
+            if connection.execute("SELECT 1 FROM pages WHERE sha256 = ? LIMIT 1", (sha256,)).fetchone():
+                continue
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(blob_path(self.root, sha256, codec))
+                removed += 1
+        return removed
+
+    def sweep(self):
+        # Приводит к keep архив, накопленный до появления ограничения или с большим keep.
+        # Возвращает число удалённых файлов
+        connection = self._connect()
+        listings = connection.execute(
+            "SELECT listing_id FROM pages GROUP BY listing_id HAVING COUNT(*) > ?", (self.keep,)
+        ).fetchall()
+        dropped = []
+        with connection:
+            for listing_id, in listings:
+                dropped += self._trim(connection, listing_id)
+        return self._remove_unreferenced(connection, dropped)
+
+    def latest(self):
+        # Последняя сохранённая страница каждого объявления:
+        # (listing_id, url, sha256, codec, fetched_at)
+        return self._connect().execute(
+            "SELECT listing_id, url, sha256, codec, MAX(fetched_at) FROM pages GROUP BY listing_id"
+        ).fetchall()
+
+    def get(self, listing_id):
+        row = self._connect().execute(
+            "SELECT sha256, codec FROM pages WHERE listing_id = ? ORDER BY fetched_at DESC LIMIT 1",
+            (listing_id,),
+        ).fetchone()
+        return read_page(self.root, *row) if row else None
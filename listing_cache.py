@@ -0,0 +1,335 @@
+""" Двухуровневый кэш разобранных объявлений: LRU в памяти процесса
+перед базой SQLite в каталоге cache/. У каждой записи свой срок жизни (ttl);
+после него запись ещё stale_ttl секунд отдаётся как устаревшая,
+пока парсер обновляет её в фоне
+"""
+import argparse
+import glob
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlite_local import LocalConnection
+
+FRESH = "fresh"
+STALE = "stale"
+
+
+class CacheEntry:
+    __slots__ = ("listing", "fetched_at", "ttl", "size")
+
+    def __init__(self, listing, fetched_at, ttl, size):
+        self.listing = listing
+        self.fetched_at = fetched_at
+        self.ttl = ttl
+        self.size = size
+
+    def state(self, stale_ttl, now=None):
+        age = (now or time.time()) - self.fetched_at
+        if age < self.ttl:
+            return FRESH
+        if age < self.ttl + stale_ttl:
+            return STALE
+        return None
+
+
+def _entry_size(data):
+    # Примерный размер записи в памяти: по длине сериализованного вида
+    return len(json.dumps(data, ensure_ascii=False))
+
+
+class MemoryCache:
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            if (old := self._entries.pop(key, None)) is not None:
+                self.size -= old.size
+            self._entries[key] = entry
+            self.size += entry.size
+            # Вытесняем самые давно использованные записи
+            while self._entries and (len(self._entries) > self.max_entries or self.size > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= evicted.size
+                self.evictions += 1
+
+    def discard(self, key):
+        with self._lock:
+            if (old := self._entries.pop(key, None)) is not None:
+                self.size -= old.size
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SqliteCache:
+    # Одна строка на объявление: структурированные поля, время загрузки и версия парсера.
+    # Режим WAL позволяет читать параллельно с записью, соединение своё у каждого потока
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS listings (
+            listing_id TEXT PRIMARY KEY,
+            url TEXT NOT NULL,
+            type_estate TEXT NOT NULL,
+            price_value TEXT NOT NULL,
+            full_address TEXT NOT NULL,
+            params TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            ttl REAL NOT NULL,
+            expires_at REAL NOT NULL,
+            parser_version INTEGER NOT NULL,
+            partial INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS listings_expires_at ON listings (expires_at);
+        -- Журнал изменений: у каждой записанной или удалённой записи свой номер, больше всех прежних.
+        -- Для объявления хранится только последний номер, поэтому журнал не растёт быстрее таблицы
+        CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            listing_id TEXT NOT NULL UNIQUE
+        );
+        CREATE TRIGGER IF NOT EXISTS listings_inserted AFTER INSERT ON listings BEGIN
+            INSERT OR REPLACE INTO changes (listing_id) VALUES (new.listing_id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS listings_updated AFTER UPDATE ON listings BEGIN
+            INSERT OR REPLACE INTO changes (listing_id) VALUES (new.listing_id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS listings_deleted AFTER DELETE ON listings BEGIN
+            INSERT OR REPLACE INTO changes (listing_id) VALUES (old.listing_id);
+        END;
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connect = LocalConnection(path, synchronous="NORMAL")
+        connection = self._connect()
+        had_changes = connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'changes'"
+        ).fetchone()
+        connection.executescript(self.SCHEMA)
+        # Базы, созданные до появления неполных записей из поисковой выдачи
+        columns = {row[1] for row in connection.execute("PRAGMA table_info(listings)")}
+        if "partial" not in columns:
+            with connection:
+                connection.execute("ALTER TABLE listings ADD COLUMN partial INTEGER NOT NULL DEFAULT 0")
+        # Базы, созданные до журнала изменений: все имеющиеся записи считаются изменёнными
+        if not had_changes:
+            with connection:
+                connection.execute(
+                    "INSERT OR IGNORE INTO changes (listing_id) SELECT listing_id FROM listings ORDER BY fetched_at"
+                )
+
+    def get(self, key, parser_version):
+        # Возвращает (данные записи, время загрузки, ttl) или None.
+        # Записи другой версии парсера считаются промахом
+        row = self._connect().execute(
+            "SELECT url, type_estate, price_value, full_address, params, fetched_at, ttl, partial"
+            " FROM listings WHERE listing_id = ? AND parser_version = ?",
+            (key, parser_version),
+        ).fetchone()
+        if row is None:
+            return None
+        url, type_estate, price_value, full_address, params, fetched_at, ttl, partial = row
+        data = {
+            "url": url,
+            "listing_id": key,
+            "type_estate": type_estate,
+            "price_value": price_value,
+            "full_address": full_address,
+            "params": json.loads(params),
+            "partial": bool(partial),
+        }
+        return data, fetched_at, ttl
+
+    def changes_since(self, seq):
+        # Записи, изменённые после номера seq, по возрастанию номера:
+        # (seq, listing_id, url, type_estate, price_value, params), params - строка JSON.
+        # У удалённой записи все поля, кроме seq и listing_id, - None
+        return self._connect().execute(
+            "SELECT changes.seq, changes.listing_id, url, type_estate, price_value, params"
+            " FROM changes LEFT JOIN listings USING (listing_id) WHERE changes.seq > ? ORDER BY changes.seq",
+            (seq,),
+        )
+
+    def put_many(self, rows, parser_version):
+        # rows: (данные записи, время загрузки, ttl)
+        connection = self._connect()
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (data["listing_id"], data["url"], data["type_estate"], data["price_value"],
+                     data["full_address"], json.dumps(data["params"], ensure_ascii=False),
+                     fetched_at, ttl, fetched_at + ttl, parser_version, int(data.get("partial", False)))
+                    for data, fetched_at, ttl in rows
+                ],
+            )
+
+    def put(self, key, data, fetched_at, ttl, parser_version):
+        self.put_many([(data, fetched_at, ttl)], parser_version)
+
+    def delete(self, key, fetched_at=None):
+        # С fetched_at удаляется только та версия записи, которую видел вызывающий:
+        # строку, обновлённую с тех пор другим процессом, не трогаем
+        connection = self._connect()
+        with connection:
+            if fetched_at is None:
+                connection.execute("DELETE FROM listings WHERE listing_id = ?", (key,))
+            else:
+                connection.execute(
+                    "DELETE FROM listings WHERE listing_id = ? AND fetched_at = ?", (key, fetched_at)
+                )
+
+    def sweep(self, stale_ttl, now=None):
+        # Удаляет записи, которые уже нельзя отдать даже как устаревшие
+        connection = self._connect()
+        with connection:
+            cursor = connection.execute(
+                "DELETE FROM listings WHERE expires_at < ?", ((now or time.time()) - stale_ttl,)
+            )
+        return cursor.rowcount
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM listings").fetchone()[0]
+
+
+def import_json_files(store, cache_dir, parser_version, default_ttl, normalize_params=None):
+    # Разовый перенос записей cache/*.json в SQLite. Старые записи с готовой строкой
+    # вместо полей восстановить нельзя - они пропускаются. Значения параметров в JSON
+    # записаны в прежнем формате: normalize_params приводит их к формату parser_version
+    imported = skipped = 0
+    rows = []
+    for path in glob.glob(os.path.join(cache_dir, "*.json")):
+        with open(path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        if isinstance(data, dict) and "listing" in data:
+            rows.append((data["listing"], data["fetched_at"], data.get("ttl", default_ttl)))
+        elif isinstance(data, dict):
+            rows.append((data, os.path.getmtime(path), default_ttl))
+        else:
+            skipped += 1
+            continue
+        if normalize_params is not None:
+            listing = rows[-1][0]
+            listing["params"] = normalize_params(listing.get("params", {}))
+        imported += 1
+        if len(rows) >= 1000:
+            store.put_many(rows, parser_version)
+            rows = []
+    store.put_many(rows, parser_version)
+    return imported, skipped
+
+
+DB_FILENAME = "listings.sqlite3"
+
+
+class ListingCache:
+    def __init__(self, cache_dir, decode, parser_version, ttl=24 * 3600, stale_ttl=7 * 24 * 3600,
+                 max_entries=10000, max_bytes=64 * 1024 * 1024):
+        # decode превращает словарь из базы обратно в запись (Listing.from_dict)
+        self.decode = decode
+        self.parser_version = parser_version
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.memory = MemoryCache(max_entries, max_bytes)
+        self.disk = SqliteCache(os.path.join(cache_dir, DB_FILENAME))
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "stale_hits": 0, "misses": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, counter):
+        with self._lock:
+            self.stats[counter] += 1
+
+    def get(self, key):
+        # Возвращает (listing, FRESH | STALE) или None
+        entry = self.memory.get(key)
+        counter = "memory_hits"
+        if entry is None or entry.state(self.stale_ttl) != FRESH:
+            # Устаревшую копию в памяти сверяем с базой: в режиме webhook запись
+            # мог уже обновить другой процесс, и загружать страницу заново не нужно
+            found = self.disk.get(key, self.parser_version)
+            if found is not None and (entry is None or found[1] > entry.fetched_at):
+                data, fetched_at, ttl = found
+                entry = CacheEntry(self.decode(data), fetched_at, ttl, _entry_size(data))
+                self.memory.put(key, entry)
+                counter = "disk_hits"
+
+        state = entry.state(self.stale_ttl) if entry is not None else None
+        if state is None:
+            if entry is not None:
+                # Запись истекла окончательно
+                self.memory.discard(key)
+                self.disk.delete(key, entry.fetched_at)
+            self._count("misses")
+            return None
+        self._count(counter)
+        if state == STALE:
+            self._count("stale_hits")
+        return entry.listing, state
+
+    def put(self, key, listing, ttl=None):
+        ttl = ttl or self.ttl
+        data = listing.to_dict()
+        fetched_at = time.time()
+        self.memory.put(key, CacheEntry(listing, fetched_at, ttl, _entry_size(data)))
+        self.disk.put(key, data, fetched_at, ttl, self.parser_version)
+
+    def put_partial(self, key, listing, ttl=None):
+        # Неполная запись из поисковой выдачи не заменяет свежую полную
+        entry = self.memory.get(key)
+        if entry is None and (found := self.disk.get(key, self.parser_version)) is not None:
+            data, fetched_at, entry_ttl = found
+            entry = CacheEntry(self.decode(data), fetched_at, entry_ttl, 0)
+        if entry is not None and not entry.listing.partial and entry.state(self.stale_ttl) == FRESH:
+            return False
+        self.put(key, listing, ttl)
+        return True
+
+    def sweep(self):
+        return self.disk.sweep(self.stale_ttl)
+
+    def hit_ratio(self):
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        total = hits + self.stats["misses"]
+        return hits / total if total else 0.0
+
+    def snapshot(self):
+        # Счётчики вместе с состоянием памяти - для логов и статистики
+        return {
+            **self.stats,
+            "evictions": self.memory.evictions,
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory.size,
+        }
+
+
+if __name__ == "__main__":
+    from avito_parser import PARSER_VERSION, normalize_params
+
+    arg_parser = argparse.ArgumentParser(description="Обслуживание кэша объявлений")
+    arg_parser.add_argument("command", choices=["import", "sweep"])
+    arg_parser.add_argument("cache_dir", nargs="?", default="cache")
+    arg_parser.add_argument("--ttl", type=int, default=24 * 3600)
+    arg_parser.add_argument("--stale-ttl", type=int, default=7 * 24 * 3600)
+    args = arg_parser.parse_args()
+
+    store = SqliteCache(os.path.join(args.cache_dir, DB_FILENAME))
+    if args.command == "import":
+        imported, skipped = import_json_files(store, args.cache_dir, PARSER_VERSION, args.ttl, normalize_params)
+        print(f"Перенесено записей: {imported}, пропущено старых строк: {skipped}")
+    else:
+        print(f"Удалено истёкших записей: {store.sweep(args.stale_ttl)}")
@@ -13,6 +13,56 @@ class Envi:
         env_path = Path(".") / ".env"
         load_dotenv(dotenv_path=env_path)
         self.token = os.getenv("TOKEN")
+        # Число процессов для разбора HTML, 0 - разбор в основном процессе
+        self.parse_workers = int(os.getenv("PARSE_WORKERS", "0"))
+        # Движок разбора HTML: html.parser или lxml
+        self.parse_backend = os.getenv("PARSE_BACKEND", "html.parser")
+        # Потоковый разбор с ранним закрытием соединения
+        self.parse_stream = os.getenv("PARSE_STREAM", "0") == "1"
+        # Кэш: свежесть и срок отдачи устаревших записей в секундах, размер LRU в памяти
+        self.cache_ttl = int(os.getenv("CACHE_TTL", str(24 * 3600)))
+        self.cache_stale_ttl = int(os.getenv("CACHE_STALE_TTL", str(7 * 24 * 3600)))
+        self.cache_max_entries = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+        self.cache_max_bytes = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+        # Сохранять сжатые исходные страницы для пересборки кэша без сети
+        self.archive_pages = os.getenv("ARCHIVE_PAGES", "1") == "1"
+        # Сколько последних страниц каждого объявления держать в архиве
+        self.archive_keep = int(os.getenv("ARCHIVE_KEEP", "3"))
+        # Загрузка: запросов в секунду к одному хосту и допустимая пачка подряд,
+        # число повторов и таймауты на соединение и чтение в секундах
+        self.rate_limit = float(os.getenv("RATE_LIMIT", "3"))
+        self.rate_burst = int(os.getenv("RATE_BURST", "5"))
+        self.http_retries = int(os.getenv("HTTP_RETRIES", "3"))
+        self.connect_timeout = float(os.getenv("CONNECT_TIMEOUT", "5"))
+        self.read_timeout = float(os.getenv("READ_TIMEOUT", "20"))
+        # Telegram ID администраторов через запятую: им доступны /stats и /profile
+        self.admin_ids = {int(user_id) for user_id in os.getenv("ADMIN_IDS", "").split(",") if user_id.strip()}
+        # Локальный порт для метрик Prometheus (GET /metrics), 0 - не запускать
+        self.metrics_port = int(os.getenv("METRICS_PORT", "0"))
+        # Несколько ссылок в одном сообщении: сколько обрабатывать и сколько загружать одновременно
+        self.max_message_urls = int(os.getenv("MAX_MESSAGE_URLS", "30"))
+        self.message_concurrency = int(os.getenv("MESSAGE_CONCURRENCY", "8"))
+        # Свой сервер Bot API вместо api.telegram.org (например, для нагрузочного стенда)
+        self.telegram_api = os.getenv("TELEGRAM_API_URL")
+        # Режим webhook: публичный адрес бота; если не задан - long polling.
+        # Локальный сервер слушает WEBHOOK_HOST:WEBHOOK_PORT, WEB_WORKERS процессов на одном порту
+        self.webhook_url = os.getenv("WEBHOOK_URL")
+        self.webhook_path = os.getenv("WEBHOOK_PATH", "/webhook")
+        self.webhook_host = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+        self.webhook_port = int(os.getenv("WEBHOOK_PORT", "8080"))
+        self.webhook_secret = os.getenv("WEBHOOK_SECRET")
+        self.web_workers = int(os.getenv("WEB_WORKERS", "1"))
+        # /watch: начальный, минимальный и максимальный интервал проверки в секундах
+        # и сколько объявлений проверять одновременно
+        self.watch_interval = int(os.getenv("WATCH_INTERVAL", "3600"))
+        self.watch_min_interval = int(os.getenv("WATCH_MIN_INTERVAL", "900"))
+        self.watch_max_interval = int(os.getenv("WATCH_MAX_INTERVAL", str(24 * 3600)))
+        self.watch_concurrency = int(os.getenv("WATCH_CONCURRENCY", "8"))
+        # Ограничения Telegram на отправку: сообщений в секунду всего и в один чат (0 - без ограничения)
+        # и сколько секунд ответ может готовиться без сообщения "Обрабатываю..."
+        self.telegram_rate = float(os.getenv("TELEGRAM_RATE", "30"))
+        self.telegram_chat_rate = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+        self.progress_delay = float(os.getenv("PROGRESS_DELAY", "0.5"))
         print(self.token)
 
 envi = Envi()
\ No newline at end of file
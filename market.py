@@ -0,0 +1,274 @@
+""" Рыночная аналитика по кэшу объявлений. Цена, площадь, этаж, год постройки,
+тип и город каждой записи лежат в компактных столбцах array; медианы и процентили
+считаются над столбцами целиком (через NumPy, если он установлен). Индекс
+сверяется с базой кэша по журналу изменений: читаются только записи, добавленные,
+обновлённые или удалённые после прошлой сверки
+"""
+import argparse
+import array
+import csv
+import json
+import math
+import os
+import re
+import sys
+from urllib.parse import urlsplit
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from avito_parser import EstateParam
+
+NUMBER_RE = re.compile(r'\d+(?:[.,]\d+)?')
+# Площадь для цены за м²: у квартир общая, у домов - площадь дома, у комнат - комнаты
+AREA_PARAMS = (EstateParam.TOTAL_AREA, EstateParam.HOUSE_AREA, EstateParam.ROOM_AREA, EstateParam.AREA)
+PERCENTILES = (10, 25, 50, 75, 90)
+
+
+def _number(value):
+    # "40.6 м²" -> 40.6, "6 из 9" -> 6.0, нет значения -> nan
+    match = NUMBER_RE.search(value or '')
+    return float(match.group().replace(',', '.')) if match else math.nan
+
+
+def _price(price_value):
+    # Обратное _format_price: "5 300 000" -> 5300000.0
+    digits = price_value.replace(' ', '').replace('\xa0', '')
+    return float(digits) if digits.isdigit() else math.nan
+
+
+def _city(url):
+    # Город - первый сегмент пути: /ekaterinburg/kvartiry/...
+    return urlsplit(url).path.strip('/').split('/')[0] or '—'
+
+
+def _percentiles(values):
+    # Линейная интерполяция, как numpy.percentile по умолчанию
+    values = sorted(values)
+    if not values:
+        return {}
+    result = {}
+    for percent in PERCENTILES:
+        rank = (len(values) - 1) * percent / 100
+        low = int(rank)
+        high = min(low + 1, len(values) - 1)
+        result[percent] = values[low] + (values[high] - values[low]) * (rank - low)
+    return result
+
+
+class MarketIndex:
+    def __init__(self):
+        # Столбцы по 8 байт на значение (коды типа и города - по 2), отсутствующее значение - nan
+        self.price = array.array('d')
+        self.area = array.array('d')
+        self.floor = array.array('d')
+        self.build_year = array.array('d')
+        self.type_code = array.array('H')
+        self.city_code = array.array('H')
+        self.types = []
+        self.cities = []
+        self._type_codes = {}
+        self._city_codes = {}
+        # listing_id -> номер строки: повторная загрузка объявления обновляет его строку
+        self._rows = {}
+        self._listing_ids = []
+        # Номер последнего прочитанного изменения в журнале кэша
+        self.synced_seq = 0
+
+    def __len__(self):
+        return len(self.price)
+
+    def _code(self, names, codes, name):
+        if name not in codes:
+            codes[name] = len(names)
+            names.append(name)
+        return codes[name]
+
+    def add(self, listing_id, url, type_estate, price_value, params):
+        # params: {EstateParam.name: значение}, как в Listing.to_dict()
+        area = next((_number(params[param.name]) for param in AREA_PARAMS if param.name in params), math.nan)
+        values = (
+            _price(price_value),
+            area,
+            _number(params.get(EstateParam.FLOOR.name)),
+            _number(params.get(EstateParam.BUILD_YEAR.name)),
+            self._code(self.types, self._type_codes, type_estate),
+            self._code(self.cities, self._city_codes, _city(url)),
+        )
+        row = self._rows.get(listing_id)
+        if row is None:
+            self._rows[listing_id] = len(self.price)
+            self._listing_ids.append(listing_id)
+            for column, value in zip(self._columns(), values):
+                column.append(value)
+        else:
+            for column, value in zip(self._columns(), values):
+                column[row] = value
+
+    def remove(self, listing_id):
+        # Последняя строка переезжает на место удалённой: столбцы остаются без пропусков
+        row = self._rows.pop(listing_id, None)
+        if row is None:
+            return False
+        last = len(self.price) - 1
+        if row != last:
+            moved = self._listing_ids[last]
+            self._rows[moved] = row
+            self._listing_ids[row] = moved
+            for column in self._columns():
+                column[row] = column[last]
+        self._listing_ids.pop()
+        for column in self._columns():
+            column.pop()
+        return True
+
+    def _columns(self):
+        return self.price, self.area, self.floor, self.build_year, self.type_code, self.city_code
+
+    def sync(self, store):
+        # Применяет изменения SqliteCache с прошлой сверки; возвращает их число
+        applied = 0
+        for seq, listing_id, url, type_estate, price_value, params in store.changes_since(self.synced_seq):
+            if url is None:
+                self.remove(listing_id)
+            else:
+                self.add(listing_id, url, type_estate, price_value, json.loads(params))
+            self.synced_seq = seq
+            applied += 1
+        return applied
+
+    def report(self, type_estate=None, city=None, by="type", limit=10):
+        # Сводка по выборке и по группам (тип или город): число объявлений,
+        # процентили цены и цены за м². Первая строка - вся выборка (группа None)
+        if numpy is not None:
+            return self._report_numpy(type_estate, city, by, limit)
+        return self._report_python(type_estate, city, by, limit)
+
+    def _report_numpy(self, type_estate, city, by, limit):
+        # frombuffer не копирует данные; представления живут только внутри вызова,
+        # иначе столбцы нельзя было бы дополнять
+        price = numpy.frombuffer(self.price, dtype=numpy.float64)
+        area = numpy.frombuffer(self.area, dtype=numpy.float64)
+        types = numpy.frombuffer(self.type_code, dtype=numpy.uint16)
+        cities = numpy.frombuffer(self.city_code, dtype=numpy.uint16)
+
+        mask = numpy.ones(len(price), dtype=bool)
+        for value, column, codes in ((type_estate, types, self._type_codes), (city, cities, self._city_codes)):
+            if value is not None:
+                mask &= column == codes.get(value, -1)
+        groups, names = (types, self.types) if by == "type" else (cities, self.cities)
+
+        # Выборка упорядочивается по коду группы (поразрядная сортировка uint16),
+        # после чего каждая группа - непрерывный срез, без отдельной маски на группу
+        selected_groups = groups[mask]
+        order = numpy.argsort(selected_groups, kind="stable")
+        prices = price[mask][order]
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            per_m2 = prices / area[mask][order]
+        counts = numpy.bincount(selected_groups, minlength=len(names))
+        bounds = numpy.concatenate(([0], numpy.cumsum(counts)))
+
+        def percentiles(values):
+            # Сортировка быстрее numpy.percentile; nan и inf после сортировки оказываются в конце
+            values = numpy.sort(values)[:numpy.count_nonzero(numpy.isfinite(values))]
+            if not values.size:
+                return {}
+            ranks = (values.size - 1) * numpy.array(PERCENTILES) / 100
+            low = ranks.astype(numpy.int64)
+            high = numpy.minimum(low + 1, values.size - 1)
+            result = values[low] + (values[high] - values[low]) * (ranks - low)
+            return dict(zip(PERCENTILES, result.tolist()))
+
+        def summarize(start, end):
+            return {
+                "count": int(end - start),
+                "price": percentiles(prices[start:end]),
+                "price_per_m2": percentiles(per_m2[start:end]),
+            }
+
+        top = [code for code in numpy.argsort(-counts, kind="stable")[:limit] if counts[code]]
+        return [(None, summarize(0, len(prices)))] + [
+            (names[code], summarize(bounds[code], bounds[code + 1])) for code in top
+        ]
+
+    def _report_python(self, type_estate, city, by, limit):
+        type_filter = self._type_codes.get(type_estate, -1) if type_estate is not None else None
+        city_filter = self._city_codes.get(city, -1) if city is not None else None
+        groups, names = (self.type_code, self.types) if by == "type" else (self.city_code, self.cities)
+        selected = {None: ([], [], [0])}
+        for row in range(len(self.price)):
+            if type_filter is not None and self.type_code[row] != type_filter:
+                continue
+            if city_filter is not None and self.city_code[row] != city_filter:
+                continue
+            price, area = self.price[row], self.area[row]
+            for key in (None, groups[row]):
+                prices, per_m2, count = selected.setdefault(key, ([], [], [0]))
+                count[0] += 1
+                if not math.isnan(price):
+                    prices.append(price)
+                    if area > 0:
+                        per_m2.append(price / area)
+
+        def summarize(key):
+            prices, per_m2, count = selected[key]
+            return {"count": count[0], "price": _percentiles(prices), "price_per_m2": _percentiles(per_m2)}
+
+        top = sorted((key for key in selected if key is not None), key=lambda key: -selected[key][2][0])[:limit]
+        return [(None, summarize(None))] + [(names[key], summarize(key)) for key in top]
+
+    def export(self, path):
+        # Построчная выгрузка столбцов в CSV для внешнего анализа
+        with open(path, "w", encoding="utf-8", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["listing_id", "type", "city", "price", "area", "floor", "build_year"])
+            for listing_id, row in self._rows.items():
+                writer.writerow([
+                    listing_id, self.types[self.type_code[row]], self.cities[self.city_code[row]],
+                    *(("" if math.isnan(value) else value) for value in (
+                        self.price[row], self.area[row], self.floor[row], self.build_year[row],
+                    )),
+                ])
+
+
+def format_report(report, by="type"):
+    # Текст для /market и командной строки
+    def money(value):
+        return f"{value:,.0f}".replace(",", " ")
+
+    lines = []
+    for name, summary in report:
+        title = "Всего" if name is None else name
+        line = f"{title}: {summary['count']} шт."
+        if summary["price"]:
+            line += f", медиана {money(summary['price'][50])} ₽"
+        if summary["price_per_m2"]:
+            per_m2 = summary["price_per_m2"]
+            line += (f", {money(per_m2[50])} ₽/м² "
+                     f"(p25–p75 {money(per_m2[25])}–{money(per_m2[75])}, p10–p90 {money(per_m2[10])}–{money(per_m2[90])})")
+        lines.append(line)
+        if name is None and len(report) > 1:
+            lines.append("По типам:" if by == "type" else "По городам:")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    from listing_cache import DB_FILENAME, SqliteCache
+
+    arg_parser = argparse.ArgumentParser(description="Аналитика по кэшу объявлений")
+    arg_parser.add_argument("cache_dir", nargs="?", default="cache")
+    arg_parser.add_argument("--type", help="тип недвижимости, например Квартира")
+    arg_parser.add_argument("--city", help="город из URL, например ekaterinburg")
+    arg_parser.add_argument("--by", choices=["type", "city"], default="type")
+    arg_parser.add_argument("--csv", help="выгрузить столбцы в CSV")
+    args = arg_parser.parse_args()
+
+    index = MarketIndex()
+    index.sync(SqliteCache(os.path.join(args.cache_dir, DB_FILENAME)))
+    if args.csv:
+        index.export(args.csv)
+        print(f"Выгружено записей: {len(index)}", file=sys.stderr)
+    else:
+        print(format_report(index.report(args.type, args.city, args.by), args.by))
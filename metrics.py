@@ -0,0 +1,164 @@
+""" Метрики бота: гистограммы длительности этапов обработки (загрузка, разбор,
+извлечение, кэш, ответ), выдача в текстовом формате Prometheus на локальном
+порту и выборочный профилировщик для разбора одного медленного запроса
+"""
+import bisect
+import contextlib
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+from aiohttp import web
+
+# Границы корзин в секундах: от долей миллисекунды (кэш) до десятков секунд (загрузка с повторами)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    # Только счётчики по корзинам, сумма и число наблюдений: запись - bisect и три сложения
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def quantile(self, q):
+        # Оценка по корзинам с линейной интерполяцией, как histogram_quantile в Prometheus
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class Metrics:
+    STAGES = ("download", "stream", "parse", "extract", "render", "cache_read", "cache_write", "archive", "send", "total")
+
+    def __init__(self):
+        self.histograms = {stage: Histogram() for stage in self.STAGES}
+        self.counters = Counter()
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            if stage not in self.histograms:
+                self.histograms[stage] = Histogram()
+            self.histograms[stage].observe(seconds)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def summary(self):
+        # Строки для /stats: число наблюдений, среднее и оценки p50/p95 в миллисекундах
+        lines = []
+        with self._lock:
+            for stage, histogram in self.histograms.items():
+                if not histogram.count:
+                    continue
+                lines.append(
+                    f"{stage}: {histogram.count} шт., среднее {histogram.sum / histogram.count * 1000:.1f} мс, "
+                    f"p50 {histogram.quantile(0.5) * 1000:.1f} мс, p95 {histogram.quantile(0.95) * 1000:.1f} мс"
+                )
+            lines.extend(f"{name}: {value}" for name, value in sorted(self.counters.items()))
+        return lines
+
+    def prometheus(self, prefix="avito"):
+        lines = [f"# TYPE {prefix}_stage_seconds histogram"]
+        with self._lock:
+            for stage, histogram in self.histograms.items():
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE {prefix}_{name}_total counter")
+                lines.append(f"{prefix}_{name}_total {value}")
+        return lines
+
+
+def prometheus_values(name, kind, values, label):
+    # Набор значений одной метрики с меткой: {"memory_hits": 3, ...} -> name{label="memory_hits"} 3
+    lines = [f"# TYPE {name} {kind}"]
+    lines.extend(f'{name}{{{label}="{key}"}} {value}' for key, value in values.items())
+    return lines
+
+
+async def start_metrics_server(render, port, host="127.0.0.1"):
+    # GET /metrics отдаёт render() в текстовом формате Prometheus; слушаем только локальный адрес
+    async def handle(request):
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+class SamplingProfiler:
+    # Фоновый поток раз в interval секунд снимает стек указанного потока и считает,
+    # какие функции в нём встречаются. Стоимость - только пока профилировщик включён
+    def __init__(self, thread_id=None, interval=0.005, depth=30):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.depth = depth
+        self.samples = 0
+        # Функция где-то в стеке (включая вызванные) и функция на вершине стека
+        self.inclusive = Counter()
+        self.leaves = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = [f"{entry.name} ({os.path.basename(entry.filename)}:{entry.lineno})"
+                     for entry in traceback.extract_stack(frame, limit=self.depth)]
+            self.samples += 1
+            self.leaves[stack[-1]] += 1
+            # При рекурсии функция считается один раз на снимок
+            self.inclusive.update(set(stack))
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def top(self, limit=10, inclusive=False):
+        # Самые частые функции и доля снимков, в которых они были
+        if not self.samples:
+            return []
+        counter = self.inclusive if inclusive else self.leaves
+        return [(line, count / self.samples) for line, count in counter.most_common(limit)]
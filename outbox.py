@@ -0,0 +1,212 @@
+""" Очередь исходящих вызовов Bot API. Отправки и правки сообщений идут через
+одну очередь с приоритетами и укладываются в ограничения Telegram: общее число
+сообщений в секунду и отдельно в каждый чат (token bucket). Ответ на запрос
+заменяет правкой сообщение "Обрабатываю...", а если ответ готов раньше, чем
+заглушка ушла, она не отправляется вовсе
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+from downloader import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты, меньше - раньше: ответы на запросы не ждут заглушек и уведомлений /watch
+RESULT = 0
+PROGRESS = 1
+NOTIFY = 2
+
+
+class OutgoingCall:
+    # Один вызов Bot API в очереди. started - запрос уже ушёл, отменить его нельзя
+    def __init__(self, method, chat_id, priority, kwargs):
+        self.method = method
+        self.chat_id = chat_id
+        self.priority = priority
+        self.kwargs = kwargs
+        self.not_before = 0.0
+        self.attempts = 0
+        self.started = False
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class Outbox:
+    def __init__(self, bot, rate=30.0, burst=5, chat_rate=1.0, chat_burst=3, group_rate=20 / 60, group_burst=3,
+                 concurrency=32, retries=3, metrics=None):
+        # rate=0 или chat_rate=0 отключает соответствующее ограничение (например, для локального стенда).
+        # Группы (отрицательный chat_id) Telegram ограничивает строже: 20 сообщений в минуту
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.retries = retries
+        self.metrics = metrics
+        self._global = TokenBucket(rate, burst) if rate else None
+        self._chats = {}
+        self._pruned = time.monotonic()
+        # Вызовы ждут своего времени в куче (not_before, seq, call), а затем - очереди
+        # по приоритету (priority, seq, call); seq сохраняет порядок внутри приоритета
+        self._waiting = []
+        self._ready = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._limit = asyncio.Semaphore(concurrency)
+        self._inflight = set()
+        self._task = None
+
+    def _count(self, name):
+        if self.metrics is not None:
+            self.metrics.inc(name)
+
+    def _chat_bucket(self, chat_id):
+        rate, burst = (self.group_rate, self.group_burst) if chat_id < 0 else (self.chat_rate, self.chat_burst)
+        if not rate:
+            return None
+        now = time.monotonic()
+        if now - self._pruned > 60:
+            # Полная корзина ничем не отличается от новой: молчащие чаты не держим в памяти
+            self._pruned = now
+            self._chats = {key: bucket for key, bucket in self._chats.items()
+                           if now - bucket.updated < bucket.burst / bucket.rate or bucket.paused_until > now}
+        if chat_id not in self._chats:
+            self._chats[chat_id] = TokenBucket(rate, burst)
+        return self._chats[chat_id]
+
+    def submit(self, method, chat_id, priority=RESULT, **kwargs):
+        # method - метод бота (send_message, edit_message_text), kwargs - его аргументы кроме chat_id.
+        # Место в ограничении чата занимается сразу: вызовы в один чат расходятся по времени
+        call = OutgoingCall(method, chat_id, priority, kwargs)
+        bucket = self._chat_bucket(chat_id)
+        call.not_before = time.monotonic() + (bucket.reserve() if bucket is not None else 0.0)
+        self._push(call)
+        return call
+
+    def _push(self, call):
+        heapq.heappush(self._waiting, (call.not_before, next(self._seq), call))
+        self._wakeup.set()
+
+    def cancel(self, call):
+        # Отменяет вызов, который ещё не отправлен; False - поздно, ответ уже есть или ожидается
+        if call.started or call.future.done():
+            return False
+        return call.future.cancel()
+
+    async def send_message(self, chat_id, text, priority=RESULT, **kwargs):
+        return await self.submit(self.bot.send_message, chat_id, priority, text=text, **kwargs).future
+
+    def progress(self, chat_id, text):
+        # Заглушка "Обрабатываю...": не ждём её, а передаём потом в reply
+        return self.submit(self.bot.send_message, chat_id, PROGRESS, text=text)
+
+    async def reply(self, chat_id, texts, progress=None, priority=RESULT, **kwargs):
+        # Ответ из одного или нескольких сообщений. Первое заменяет заглушку, если она успела
+        # уйти; неотправленная заглушка отменяется, и ответ уходит обычным сообщением
+        texts = list(texts)
+        message = None
+        if progress is not None:
+            if self.cancel(progress):
+                self._count("telegram_progress_skipped")
+            else:
+                try:
+                    message = await progress.future
+                except Exception as e:
+                    logger.warning(f"Не удалось отправить заглушку в чат {chat_id}: {e}")
+
+        sent = []
+        if message is not None and texts:
+            try:
+                sent.append(await self.submit(
+                    self.bot.edit_message_text, chat_id, priority,
+                    text=texts[0], message_id=message.message_id, **kwargs
+                ).future)
+                texts = texts[1:]
+            except TelegramBadRequest as e:
+                # Заглушку удалили или её уже нельзя править - отвечаем новым сообщением
+                logger.warning(f"Не удалось заменить заглушку в чате {chat_id}: {e}")
+        for text in texts:
+            sent.append(await self.send_message(chat_id, text, priority, **kwargs))
+        return sent
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Ушедшие запросы дожидаемся, остальные отменяем
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+        for _, _, call in self._waiting + self._ready:
+            call.future.cancel()
+        self._waiting.clear()
+        self._ready.clear()
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            while self._waiting and self._waiting[0][0] <= now:
+                _, seq, call = heapq.heappop(self._waiting)
+                heapq.heappush(self._ready, (call.priority, seq, call))
+            # Отменённые заглушки просто выбрасываются
+            while self._ready and self._ready[0][2].future.done():
+                heapq.heappop(self._ready)
+
+            timeout = self._waiting[0][0] - now if self._waiting else None
+            if self._ready:
+                wait = self._global.ready_in() if self._global is not None else 0.0
+                if wait <= 0:
+                    # Самый важный из готовых вызовов; сам запрос не задерживает очередь
+                    _, _, call = heapq.heappop(self._ready)
+                    if self._global is not None:
+                        self._global.reserve()
+                    call.started = True
+                    await self._limit.acquire()
+                    task = asyncio.create_task(self._deliver(call))
+                    self._inflight.add(task)
+                    task.add_done_callback(self._inflight.discard)
+                    continue
+                timeout = wait if timeout is None else min(timeout, wait)
+
+            # Спим до ближайшего вызова по расписанию, свободного токена или нового вызова
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver(self, call):
+        try:
+            self._count("telegram_calls")
+            result = await call.method(chat_id=call.chat_id, **call.kwargs)
+        except TelegramRetryAfter as e:
+            # Telegram сам попросил подождать: чат молчит retry_after секунд, вызов возвращается в очередь
+            self._count("telegram_retry_after")
+            if call.attempts < self.retries:
+                call.attempts += 1
+                call.started = False
+                if (bucket := self._chat_bucket(call.chat_id)) is not None:
+                    bucket.pause(e.retry_after)
+                call.not_before = time.monotonic() + e.retry_after
+                self._push(call)
+            elif not call.future.done():
+                call.future.set_exception(e)
+        except Exception as e:
+            # Ожидавший ответа мог быть отменён вместе со своим future
+            if not call.future.done():
+                call.future.set_exception(e)
+        else:
+            if not call.future.done():
+                call.future.set_result(result)
+        finally:
+            self._limit.release()
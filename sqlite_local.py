@@ -0,0 +1,28 @@
+""" Соединения SQLite для кэша, архива страниц и подписок: у каждого потока своё
+соединение в режиме WAL, процесс-наследник после fork открывает новое
+"""
+import os
+import sqlite3
+import threading
+
+
+class LocalConnection:
+    # Вызывается вместо sqlite3.connect: connection = self._connect().
+    # synchronous="NORMAL" ускоряет запись ценой последних транзакций при сбое питания
+    def __init__(self, path, synchronous=None, timeout=30):
+        self.path = path
+        self.synchronous = synchronous
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def __call__(self):
+        # Соединение нельзя использовать после fork: процесс-наследник открывает своё
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout)
+            connection.execute("PRAGMA journal_mode=WAL")
+            if self.synchronous:
+                connection.execute(f"PRAGMA synchronous={self.synchronous}")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
@@ -0,0 +1,82 @@
+""" Общие заготовки тестов: локальный HTTP-сервер с заранее заданными ответами
+вместо Avito и минимальная страница объявления
+"""
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+# Модули проекта лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+LISTING_HTML = (
+    '<!DOCTYPE html><html><head><title>1-к. квартира, 40,6 м², 6/9 эт. на продажу в Екатеринбурге</title>'
+    '<meta charset="utf-8"></head><body>'
+    '<span itemprop="price" content="5300000">5300000</span>'
+    '<div data-marker="item-view/item-params"><ul>'
+    '<li class="params-paramsList__item-_2Y2O"><span class="styles-module-noAccent-l9CMS">Количество комнат: </span>1</li>'
+    '<li class="params-paramsList__item-_2Y2O"><span class="styles-module-noAccent-l9CMS">Общая площадь: </span>40.6\xa0м²</li>'
+    '<li class="params-paramsList__item-_2Y2O"><span class="styles-module-noAccent-l9CMS">Этаж: </span>6 из 9</li>'
+    '</ul></div>'
+    '<div><span class="style-item-address__string-wt61A">Свердловская область, Екатеринбург, ул. Ленина, 5</span></div>'
+    '</body></html>'
+)
+
+
+class StubServer(ThreadingHTTPServer):
+    # Отвечает по порядку ответами (статус, заголовки, тело); последний ответ повторяется.
+    # latency держит каждый ответ, чтобы одновременные запросы успели пересечься
+    daemon_threads = True
+
+    def __init__(self, responses, latency=0.0):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.responses = list(responses)
+        self.latency = latency
+        self.hits = 0
+        self.hit_times = []
+        self._lock = threading.Lock()
+
+    def next_response(self):
+        with self._lock:
+            self.hits += 1
+            self.hit_times.append(time.monotonic())
+            return self.responses[min(self.hits, len(self.responses)) - 1]
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server_address[1]}{path}"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        status, headers, body = self.server.next_response()
+        time.sleep(self.server.latency)
+        body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    servers = []
+
+    def start(responses, latency=0.0):
+        server = StubServer(responses, latency)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
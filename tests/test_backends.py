@@ -0,0 +1,44 @@
+""" Разбор через lxml и потоковый разбор должны давать ту же запись, что html.parser """
+import glob
+import os
+
+import pytest
+
+from avito_parser import ListingExtractor, ListingStream
+
+PAGES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "pages", "*.html")))
+
+
+def _page(path):
+    with open(path, encoding="utf-8") as file:
+        url = "https://www.avito.ru/ekaterinburg/x/" + os.path.basename(path).replace(".html", "_123")
+        return file.read(), url
+
+
+@pytest.fixture(scope="module")
+def reference():
+    extractor = ListingExtractor()
+    return {path: extractor._parse_html(*_page(path)) for path in PAGES}
+
+
+@pytest.mark.parametrize("path", PAGES, ids=os.path.basename)
+def test_lxml_matches_html_parser(path, reference):
+    assert ListingExtractor("lxml")._parse_html(*_page(path)) == reference[path]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 1024, 1 << 20])
+@pytest.mark.parametrize("path", PAGES, ids=os.path.basename)
+def test_stream_matches_html_parser(path, chunk_size, reference):
+    html, url = _page(path)
+    stream = ListingStream()
+    for start in range(0, len(html), chunk_size):
+        stream.feed(html[start:start + chunk_size])
+        if stream.done:
+            break
+    assert ListingExtractor()._finish_stream(stream, url) == reference[path]
+
+
+def test_corpus_covers_types(reference):
+    # Корпус проверяет все ветки схемы, а не только квартиры
+    assert {listing.type_estate for listing in reference.values()} >= {"Квартира", "Студия", "Комната", "Дом", "ИЖС", "Гараж"}
+    assert all(listing.params for listing in reference.values())
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from avito_parser import AvitoParser, Listing, parse_batch
+from conftest import LISTING_HTML
+from downloader import Downloader
+
+
+def _run_batch(parser, urls):
+    async def run():
+        try:
+            return [result async for result in parse_batch(parser, urls, concurrency=2)]
+        finally:
+            await parser.close()
+
+    return {result["url"]: result for result in asyncio.run(run())}
+
+
+def test_batch_counts_each_miss_once(stub_server, tmp_path):
+    server = stub_server([(200, {}, LISTING_HTML)])
+    parser = AvitoParser(cache_dir=str(tmp_path), downloader=Downloader(rate=0, retries=0))
+    url = server.url("/ekaterinburg/kvartiry/kvartira_111")
+
+    first = _run_batch(parser, [url])[url]
+    second = _run_batch(parser, [url])[url]
+
+    assert (first["cached"], second["cached"]) == (False, True)
+    assert server.hits == 1
+    assert parser.cache.snapshot()["misses"] == 1
+
+
+def test_batch_refreshes_partial_listing(stub_server, tmp_path):
+    server = stub_server([(200, {}, LISTING_HTML)])
+    parser = AvitoParser(cache_dir=str(tmp_path), downloader=Downloader(rate=0, retries=0))
+    url = server.url("/ekaterinburg/kvartiry/kvartira_222")
+    full = _run_batch(parser, [url])[url]["listing"]
+    # Так лежит в кэше запись из поисковой выдачи
+    parser.cache.put("222", Listing.from_dict({**full, "partial": True}))
+
+    result = _run_batch(parser, [url])[url]
+
+    assert result["cached"] is False
+    assert result["listing"]["partial"] is False
+    assert server.hits == 2
+
+
+def test_batch_raises_source_error(stub_server, tmp_path):
+    server = stub_server([(200, {}, LISTING_HTML)])
+    parser = AvitoParser(cache_dir=str(tmp_path), downloader=Downloader(rate=0, retries=0))
+
+    def source():
+        # Вторая строка входного файла не в UTF-8
+        yield server.url("/ekaterinburg/kvartiry/kvartira_333")
+        raise UnicodeDecodeError("utf-8", b"\xff", 0, 1, "invalid start byte")
+
+    async def run():
+        results = []
+        try:
+            async for result in parse_batch(parser, source(), concurrency=2):
+                results.append(result)
+        finally:
+            await parser.close()
+        return results
+
+    with pytest.raises(UnicodeDecodeError):
+        asyncio.run(asyncio.wait_for(run(), timeout=10))
+    assert server.hits == 1
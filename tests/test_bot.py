@@ -0,0 +1,59 @@
+import datetime
+import importlib
+import os
+
+import pytest
+from aiogram.types import Chat, Message, MessageEntity
+
+
+@pytest.fixture(scope="module")
+def bot(tmp_path_factory):
+    # bot.py при импорте требует TOKEN и создаёт парсер с кэшем в ./cache
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("bot"))
+    os.environ.setdefault("TOKEN", "123456:test")
+    try:
+        return importlib.import_module("bot")
+    finally:
+        os.chdir(cwd)
+
+
+def _message(text, entities=None):
+    return Message(message_id=1, date=datetime.datetime.now(), chat=Chat(id=1, type="private"),
+                   text=text, entities=entities)
+
+
+def test_extract_urls_from_text(bot):
+    message = _message(
+        "Сравни: https://www.avito.ru/ekaterinburg/kvartiry/kvartira_1, m.avito.ru/ekaterinburg/doma/dom_2. "
+        "И ещё avito.ru/ekaterinburg/kvartiry/kvartira_1?context=abc (тот же)"
+    )
+
+    assert bot.extract_urls(message) == [
+        "https://www.avito.ru/ekaterinburg/kvartiry/kvartira_1",
+        "https://m.avito.ru/ekaterinburg/doma/dom_2",
+    ]
+
+
+@pytest.mark.parametrize("text", [
+    "https://notavito.ru/x_1",
+    "https://example.com/avito.ru/x_1",
+    "mail@avito.ru/x_1",
+    "https://avito.ru.example.com/x_1",
+])
+def test_extract_urls_ignores_other_hosts(bot, text):
+    assert bot.extract_urls(_message(text)) == []
+
+
+def test_extract_urls_from_hidden_link(bot):
+    url = "https://www.avito.ru/ekaterinburg/garazhi/garazh_3"
+    message = _message("вот этот гараж", [MessageEntity(type="text_link", offset=4, length=5, url=url)])
+
+    assert bot.extract_urls(message) == [url]
+
+
+def test_pack_messages_fills_up_to_limit(bot):
+    parts = ["a" * 40, "b" * 50, "c" * 10, "d" * 120]
+
+    assert bot.pack_messages(parts, limit=100) == ["a" * 40 + "b" * 50 + "c" * 10, "d" * 120]
+    assert bot.pack_messages([], limit=100) == []
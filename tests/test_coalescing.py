@@ -0,0 +1,43 @@
+import asyncio
+
+from avito_parser import AvitoParser
+from conftest import LISTING_HTML
+from downloader import DownloadError, Downloader
+
+LISTING_PATH = "/ekaterinburg/kvartiry/1-k._kvartira_406_m_69_et._4574477371"
+
+
+def _parse_concurrently(server, cache_dir, count=20):
+    # count одновременных запросов одного объявления с разными ?context=...
+    parser = AvitoParser(cache_dir=str(cache_dir), downloader=Downloader(rate=0, retries=0))
+
+    async def run():
+        try:
+            return await asyncio.gather(
+                *(parser.parse_async(server.url(f"{LISTING_PATH}?context={n}")) for n in range(count)),
+                return_exceptions=True,
+            )
+        finally:
+            await parser.close()
+
+    return asyncio.run(run())
+
+
+def test_concurrent_lookups_share_one_download(stub_server, tmp_path):
+    server = stub_server([(200, {}, LISTING_HTML)], latency=0.2)
+    results = _parse_concurrently(server, tmp_path)
+
+    assert server.hits == 1
+    assert all(result is results[0] for result in results)
+    assert results[0].listing_id == "4574477371"
+    assert results[0].price_value == "5 300 000"
+
+
+def test_concurrent_lookups_share_one_error(stub_server, tmp_path):
+    server = stub_server([(404, {}, "")], latency=0.2)
+    results = _parse_concurrently(server, tmp_path)
+
+    assert server.hits == 1
+    assert isinstance(results[0], DownloadError)
+    assert results[0].status == 404
+    assert all(result is results[0] for result in results)
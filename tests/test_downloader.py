@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from downloader import DownloadError, Downloader
+
+
+def _fetch(downloader, url, sync):
+    if sync:
+        try:
+            return downloader.fetch_text_sync(url)
+        finally:
+            asyncio.run(downloader.close())
+
+    async def run():
+        try:
+            return await downloader.fetch_text(url)
+        finally:
+            await downloader.close()
+
+    return asyncio.run(run())
+
+
+@pytest.fixture(params=[False, True], ids=["async", "sync"])
+def sync(request):
+    return request.param
+
+
+def test_retries_until_success(stub_server, sync):
+    server = stub_server([(503, {}, ""), (502, {}, ""), (200, {}, "ok")])
+    downloader = Downloader(rate=0, retries=3, backoff=0.01)
+
+    assert _fetch(downloader, server.url("/"), sync) == "ok"
+    assert server.hits == 3
+    assert downloader.stats == {"requests": 3, "retries": 2, "throttled": 0}
+
+
+def test_gives_up_after_retries(stub_server, sync):
+    server = stub_server([(503, {}, "")])
+    downloader = Downloader(rate=0, retries=2, backoff=0.01)
+
+    with pytest.raises(DownloadError) as error:
+        _fetch(downloader, server.url("/"), sync)
+    assert error.value.status == 503
+    assert server.hits == 3
+
+
+def test_not_found_is_not_retried(stub_server, sync):
+    server = stub_server([(404, {}, "")])
+    downloader = Downloader(rate=0, retries=3, backoff=0.01)
+
+    with pytest.raises(DownloadError) as error:
+        _fetch(downloader, server.url("/"), sync)
+    assert error.value.status == 404
+    assert not error.value.throttled
+    assert server.hits == 1
+    assert downloader.stats["retries"] == 0
+
+
+def test_retry_after_is_honoured(stub_server, sync):
+    # Без Retry-After повтор ушёл бы почти сразу: backoff намного меньше секунды
+    server = stub_server([(429, {"Retry-After": "1"}, ""), (200, {}, "ok")])
+    downloader = Downloader(rate=10, burst=10, retries=1, backoff=0.01)
+
+    assert _fetch(downloader, server.url("/"), sync) == "ok"
+    assert server.hits == 2
+    assert server.hit_times[1] - server.hit_times[0] >= 1.0
+    assert downloader.stats["throttled"] == 1
+
+
+@pytest.mark.parametrize("status", [403, 429])
+def test_throttled_statuses(stub_server, sync, status):
+    server = stub_server([(status, {}, "")])
+    downloader = Downloader(rate=0, retries=1, backoff=0.01)
+
+    with pytest.raises(DownloadError) as error:
+        _fetch(downloader, server.url("/"), sync)
+    assert error.value.status == status
+    assert error.value.throttled
+    assert downloader.stats["throttled"] == 2
@@ -0,0 +1,41 @@
+from avito_parser import ListingExtractor
+from conftest import LISTING_HTML
+
+URL = "https://www.avito.ru/ekaterinburg/kvartiry/kvartira_4574477371"
+
+
+def _param_item(label, value):
+    return (f'<li class="params-paramsList__item-_2Y2O"><span class="styles-module-noAccent-l9CMS">'
+            f'{label}: </span>{value}</li>')
+
+
+def test_page_fields_follow_type_schema():
+    # "Материал стен" у квартир есть в схеме, "Тип гаража" - нет
+    html = LISTING_HTML.replace("</ul>", _param_item("Материал стен", "кирпич")
+                                + _param_item("Тип гаража", "кирпичный") + "</ul>")
+    listing = ListingExtractor()._parse_html(html, URL)
+
+    assert dict(listing.params) == {"ROOMS": "1", "TOTAL_AREA": "40.6", "FLOOR": "6/9", "WALL_MATERIAL": "кирпич"}
+
+
+def test_house_keeps_rooms_and_house_type():
+    html = (LISTING_HTML
+            .replace("1-к. квартира, 40,6 м², 6/9 эт.", "Дом 127,4 м² на участке 7,6 сот.")
+            .replace("</ul>", _param_item("Тип дома", "коттедж") + _param_item("Площадь дома", "127,4 м²") + "</ul>"))
+    listing = ListingExtractor()._parse_html(html, URL)
+
+    params = dict(listing.params)
+    assert listing.type_estate == "Дом"
+    assert (params["ROOMS"], params["HOUSE_TYPE"], params["HOUSE_AREA"]) == ("1", "коттедж", "127.4")
+
+
+def test_summary_params_follow_type():
+    extractor = ListingExtractor()
+
+    flat = dict(extractor._summary_params("Квартира", "1-к. квартира, 40,6 м², 6/9 эт."))
+    room = dict(extractor._summary_params("Комната", "Комната 13 м² в 3-к. квартире, 2/5 эт."))
+    house = dict(extractor._summary_params("Дом", "Дом 127,4 м² на участке 7,6 сот."))
+
+    assert flat == {"ROOMS": "1", "TOTAL_AREA": "40.6", "FLOOR": "6/9", "FLOORS_IN_HOUSE": "9"}
+    assert room == {"ROOMS_IN_APARTMENT": "3", "ROOM_AREA": "13", "FLOOR": "2/5", "FLOORS_IN_HOUSE": "5"}
+    assert house == {"HOUSE_AREA": "127.4", "PLOT_AREA": "7.6 сот."}
@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+from avito_parser import PARSER_VERSION, EstateParam, Listing, normalize_params
+from listing_cache import FRESH, ListingCache, SqliteCache, import_json_files
+
+
+def test_json_import_normalizes_old_values(tmp_path):
+    listing = {
+        "url": "https://www.avito.ru/ekaterinburg/kvartiry/kvartira_5",
+        "listing_id": "5",
+        "type_estate": "Квартира",
+        "price_value": "5 300 000",
+        "full_address": "Екатеринбург",
+        "params": {"ROOMS": "1", "TOTAL_AREA": "40,6 м²", "FLOOR": "6 из 9"},
+    }
+    (tmp_path / "5.json").write_text(
+        json.dumps({"listing": listing, "fetched_at": 1000.0, "ttl": 3600}, ensure_ascii=False), encoding="utf-8"
+    )
+    store = SqliteCache(str(tmp_path / "cache.sqlite3"))
+
+    assert import_json_files(store, str(tmp_path), PARSER_VERSION, 3600, normalize_params) == (1, 0)
+    data, _, _ = store.get("5", PARSER_VERSION)
+    assert Listing.from_dict(data).get(EstateParam.TOTAL_AREA) == "40.6"
+    assert data["params"] == {"ROOMS": "1", "TOTAL_AREA": "40.6", "FLOOR": "6/9"}
+
+
+def _listing(price):
+    return Listing(url="https://www.avito.ru/ekaterinburg/kvartiry/kvartira_7", listing_id="7",
+                   type_estate="Квартира", price_value=price, full_address="Екатеринбург", params=())
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("listing_cache.time.time", lambda: now[0])
+    return now
+
+
+def _worker(cache_dir):
+    # Отдельный ListingCache над общей базой - как процесс бота в режиме webhook
+    return ListingCache(str(cache_dir), decode=Listing.from_dict, parser_version=PARSER_VERSION,
+                        ttl=10, stale_ttl=10)
+
+
+def test_stale_memory_copy_picks_up_refresh_from_other_process(tmp_path, clock):
+    first, second = _worker(tmp_path), _worker(tmp_path)
+    first.put("7", _listing("1 000"))
+    assert second.get("7") == (_listing("1 000"), FRESH)
+
+    clock[0] += 15
+    first.put("7", _listing("2 000"))
+
+    assert second.get("7") == (_listing("2 000"), FRESH)
+
+
+def test_expired_memory_copy_does_not_delete_newer_row(tmp_path, clock):
+    first, second = _worker(tmp_path), _worker(tmp_path)
+    first.put("7", _listing("1 000"))
+    second.get("7")
+
+    clock[0] += 25
+    first.put("7", _listing("2 000"))
+    assert second.get("7") == (_listing("2 000"), FRESH)
+
+    # Строку обновили между чтением и удалением истёкшей версии
+    second.disk.delete("7", fetched_at=1000.0)
+    assert first.disk.get("7", PARSER_VERSION)[1] == clock[0]
@@ -0,0 +1,59 @@
+import sqlite3
+
+from listing_cache import SqliteCache
+from market import MarketIndex
+
+
+def _row(listing_id, price, area, fetched_at=1000.0, type_estate="Квартира"):
+    data = {
+        "listing_id": listing_id,
+        "url": f"https://www.avito.ru/ekaterinburg/kvartiry/kvartira_{listing_id}",
+        "type_estate": type_estate,
+        "price_value": f"{price:,}".replace(",", " "),
+        "full_address": "Екатеринбург",
+        "params": {"TOTAL_AREA": f"{area} м²"},
+    }
+    return data, fetched_at, 3600
+
+
+def _index_rows(index):
+    return {listing_id: (index.price[row], index.area[row]) for listing_id, row in index._rows.items()}
+
+
+def test_sync_applies_updates_and_deletions(tmp_path):
+    store = SqliteCache(str(tmp_path / "cache.sqlite3"))
+    store.put_many([_row("1", 1000000, 10), _row("2", 2000000, 20), _row("3", 3000000, 30)], 2)
+    index = MarketIndex()
+    assert index.sync(store) == 3
+
+    # Пересборка из архива пишет запись с прежним временем загрузки
+    store.put_many([_row("2", 2500000, 25)], 2)
+    store.delete("1")
+    assert index.sync(store) == 2
+    assert _index_rows(index) == {"2": (2500000.0, 25.0), "3": (3000000.0, 30.0)}
+    assert len(index) == 2
+
+    # Истёкшие записи удаляет sweep
+    assert store.sweep(0, now=10000.0) == 2
+    assert index.sync(store) == 2
+    assert len(index) == 0 and index._rows == {}
+    assert index.sync(store) == 0
+
+
+def test_existing_database_is_backfilled(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    store = SqliteCache(path)
+    store.put_many([_row("1", 1000000, 10), _row("2", 2000000, 20)], 2)
+    # База, созданная до журнала изменений
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        DROP TRIGGER listings_inserted;
+        DROP TRIGGER listings_updated;
+        DROP TRIGGER listings_deleted;
+        DROP TABLE changes;
+    """)
+    connection.close()
+
+    index = MarketIndex()
+    assert index.sync(SqliteCache(path)) == 2
+    assert _index_rows(index) == {"1": (1000000.0, 10.0), "2": (2000000.0, 20.0)}
@@ -0,0 +1,116 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from fake_telegram import serve_telegram
+from metrics import Metrics
+from outbox import NOTIFY, RESULT, Outbox
+
+CHAT_ID = 42
+
+
+def _run(telegram, scenario, **outbox_kwargs):
+    # scenario(outbox) выполняется с настоящим aiogram.Bot против локальной замены Bot API
+    async def run():
+        api_url = f"http://127.0.0.1:{telegram.server_address[1]}"
+        bot = Bot("123456:test", session=AiohttpSession(api=TelegramAPIServer.from_base(api_url)))
+        outbox = Outbox(bot, **{"rate": 0, "chat_rate": 0, "metrics": Metrics(), **outbox_kwargs})
+        try:
+            return outbox, await scenario(outbox)
+        finally:
+            await outbox.stop()
+            await bot.session.close()
+
+    try:
+        return asyncio.run(run())
+    finally:
+        telegram.shutdown()
+        telegram.server_close()
+
+
+def test_unsent_placeholder_is_cancelled():
+    telegram = serve_telegram()
+
+    async def scenario(outbox):
+        # Ответ готов раньше, чем очередь успела отправить заглушку
+        progress = outbox.progress(CHAT_ID, "Обрабатываю...")
+        outbox.start()
+        return await outbox.reply(CHAT_ID, ["ответ"], progress)
+
+    outbox, sent = _run(telegram, scenario)
+
+    assert [message.text for message in sent] == ["ответ"]
+    assert (telegram.calls, telegram.edits) == (1, 0)
+    assert outbox.metrics.counters["telegram_progress_skipped"] == 1
+
+
+def test_sent_placeholder_is_edited():
+    telegram = serve_telegram()
+
+    async def scenario(outbox):
+        outbox.start()
+        progress = outbox.progress(CHAT_ID, "Обрабатываю...")
+        placeholder = await progress.future
+        sent = await outbox.reply(CHAT_ID, ["ответ", "продолжение"], progress)
+        return placeholder, sent
+
+    _, (placeholder, sent) = _run(telegram, scenario)
+
+    assert sent[0].message_id == placeholder.message_id
+    assert [message.text for message in sent] == ["ответ", "продолжение"]
+    assert (telegram.calls, telegram.edits, telegram.replies) == (3, 1, 2)
+
+
+def test_retry_after_requeues_call():
+    # Сервер пропускает одно сообщение в чат в секунду; у очереди своего ограничения нет
+    telegram = serve_telegram(chat_rate=1, chat_burst=1)
+
+    async def scenario(outbox):
+        outbox.start()
+        started = time.monotonic()
+        sent = await asyncio.gather(*(outbox.send_message(CHAT_ID, f"ответ {n}") for n in range(2)))
+        return sent, time.monotonic() - started
+
+    outbox, (sent, elapsed) = _run(telegram, scenario)
+
+    assert sorted(message.text for message in sent) == ["ответ 0", "ответ 1"]
+    assert telegram.flooded == 1
+    assert telegram.replies == 2
+    assert outbox.metrics.counters["telegram_retry_after"] == 1
+    assert elapsed >= 1.0
+
+
+class RecordingBot:
+    # Запоминает порядок вызовов, не обращаясь к сети
+    def __init__(self):
+        self.texts = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.texts.append(text)
+        return SimpleNamespace(message_id=len(self.texts), chat_id=chat_id, text=text)
+
+
+def test_result_overtakes_queued_notifications():
+    bot = RecordingBot()
+
+    async def run():
+        # Не больше 10 вызовов в секунду на всех и без запаса: уведомления копятся в очереди
+        outbox = Outbox(bot, rate=10, burst=1, chat_rate=0)
+        outbox.start()
+        try:
+            notifications = [outbox.submit(bot.send_message, chat_id, NOTIFY, text=f"уведомление {chat_id}")
+                             for chat_id in range(1, 6)]
+            await notifications[0].future
+            result = outbox.submit(bot.send_message, 100, RESULT, text="ответ")
+            await asyncio.gather(result.future, *(call.future for call in notifications))
+        finally:
+            await outbox.stop()
+
+    asyncio.run(run())
+
+    assert bot.texts[:2] == ["уведомление 1", "ответ"]
+    assert sorted(bot.texts[2:]) == [f"уведомление {chat_id}" for chat_id in range(2, 6)]
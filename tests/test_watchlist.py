@@ -0,0 +1,126 @@
+import asyncio
+import sqlite3
+import time
+
+from avito_parser import Listing
+from downloader import DownloadError
+from watchlist import Watcher, WatchStore, listing_changes
+
+
+def _snapshot(type_estate, price, **params):
+    return {"type_estate": type_estate, "price_value": price, "params": params}
+
+
+def test_old_format_values_are_not_changes():
+    old = _snapshot("Квартира", "5 300 000", TOTAL_AREA="40,6 м²", FLOOR="6 из 9")
+    new = _snapshot("Квартира", "5 300 000", TOTAL_AREA="40.6", FLOOR="6/9")
+
+    assert listing_changes(old, new) == []
+
+
+def test_fields_outside_schema_are_ignored():
+    # Старый снимок дома с полем, которое схема для домов больше не извлекает
+    old = _snapshot("Дом", "9 000 000", HOUSE_AREA="120", ROOMS_IN_APARTMENT="4")
+    new = _snapshot("Дом", "8 500 000", HOUSE_AREA="120")
+
+    assert listing_changes(old, new) == ["💵 Цена: 9 000 000₽ → 8 500 000₽"]
+
+
+def test_removed_schema_field_is_reported():
+    old = _snapshot("Квартира", "5 300 000", TOTAL_AREA="40.6", BUILD_YEAR="1975")
+    new = _snapshot("Квартира", "5 300 000", TOTAL_AREA="40.6")
+
+    assert listing_changes(old, new) == ["📅 Год постройки: 1975 → —"]
+
+
+def _listing(price):
+    return Listing(url="https://www.avito.ru/ekaterinburg/kvartiry/kvartira_7", listing_id="7",
+                   type_estate="Квартира", price_value=price, full_address="Екатеринбург", params=())
+
+
+class FakeParser:
+    # Отдаёт заранее заданные результаты проверок по очереди; последний повторяется
+    def __init__(self, results):
+        self.results = list(results)
+        self.calls = 0
+
+    async def parse_async(self, url, use_cache=True):
+        self.calls += 1
+        result = self.results[min(self.calls, len(self.results)) - 1]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def _watcher(tmp_path, results, **kwargs):
+    notifications = []
+
+    async def notify(chat_ids, url, listing, changes):
+        notifications.append((chat_ids, listing and listing.price_value, changes))
+
+    store = WatchStore(str(tmp_path / "watches.sqlite3"))
+    store.add(1, _listing("1 000"), 100, time.time())
+    return Watcher(store, FakeParser(results), notify, **kwargs), notifications
+
+
+def test_take_due_orders_by_time_and_skips_rescheduled():
+    watcher = Watcher(None, None, None, batch_size=2)
+    watcher._push("a", 5.0)
+    watcher._push("b", 1.0)
+    watcher._push("a", 2.0)
+    watcher._push("c", 3.0)
+
+    assert watcher._take_due(4.0) == ["b", "a"]
+    assert watcher._take_due(4.0) == ["c"]
+    # Прежнее время "a" (5.0) устарело после переноса
+    assert watcher._take_due(10.0) == []
+
+
+def test_interval_adapts_to_changes(tmp_path):
+    results = [_listing("2 000"), _listing("3 000"), _listing("3 000"), DownloadError(503)]
+    watcher, notifications = _watcher(tmp_path, results, interval=100, min_interval=30, max_interval=300)
+
+    intervals = []
+    for _ in results:
+        asyncio.run(watcher._check("7"))
+        intervals.append(watcher.store.get("7")[2])
+
+    # Изменилось - чаще (не чаще min_interval), не изменилось - реже, ошибка - как было
+    assert intervals == [50, 30, 45, 45]
+    assert [price for _, price, _ in notifications] == ["2 000", "3 000"]
+    assert watcher.store.get("7")[1]["price_value"] == "3 000"
+
+
+def test_removed_listing_is_dropped(tmp_path):
+    watcher, notifications = _watcher(tmp_path, [DownloadError(404)])
+
+    asyncio.run(watcher._check("7"))
+
+    assert notifications == [([1], None, [])]
+    assert watcher.store.get("7") is None
+
+
+def test_scheduler_survives_store_errors(tmp_path):
+    watcher, _ = _watcher(tmp_path, [_listing("1 000")], min_interval=0.05, sync_interval=3600)
+    update = watcher.store.update
+    failures = []
+
+    def flaky_update(*args):
+        if not failures:
+            failures.append(args)
+            raise sqlite3.OperationalError("database is locked")
+        update(*args)
+
+    watcher.store.update = flaky_update
+
+    async def run():
+        watcher.start()
+        try:
+            while watcher.parser.calls < 2 and not watcher._task.done():
+                await asyncio.sleep(0.01)
+            return watcher._task.done()
+        finally:
+            await watcher.stop()
+
+    assert asyncio.run(asyncio.wait_for(run(), timeout=5)) is False
+    assert watcher.parser.calls >= 2
@@ -0,0 +1,282 @@
+""" Подписки на изменения объявлений (/watch). Объявления проверяются
+по расписанию из одной кучи с временем следующей проверки: один таймер
+на всех, пачками и с ограничением числа одновременных загрузок. Интервал
+подстраивается: объявление, которое меняется, проверяется чаще, неизменное - реже
+"""
+import asyncio
+import heapq
+import json
+import logging
+import os
+import random
+import time
+
+from avito_parser import ALL_FIELDS, TYPE_FIELDS, EstateParam, normalize_param
+from downloader import DownloadError
+from sqlite_local import LocalConnection
+
+logger = logging.getLogger(__name__)
+
+
+def listing_changes(old, new):
+    # Изменения цены и параметров между двумя снимками Listing.to_dict() - строки для сообщения
+    changes = []
+    if old["price_value"] != new["price_value"]:
+        changes.append(f"💵 Цена: {old['price_value']}₽ → {new['price_value']}₽")
+    # Сравниваем только поля, которые схема извлекает для нового типа, и то, что в новом снимке есть:
+    # поле, которое схема больше не извлекает, не должно выглядеть как "значение → —"
+    fields = {param for param, _, _ in TYPE_FIELDS.get(new["type_estate"], ALL_FIELDS)}
+    for param in EstateParam:
+        if param not in fields and param.name not in new["params"]:
+            continue
+        before = old["params"].get(param.name)
+        after = new["params"].get(param.name)
+        # Снимок мог сохраниться до смены формата значений ("6 из 9" -> "6/9")
+        if before is not None:
+            before = normalize_param(param, before)
+        if before != after:
+            changes.append(param.display_format.format(f"{before or '—'} → {after or '—'}"))
+    return changes
+
+
+class WatchStore:
+    # Проверяемое объявление хранится один раз, сколько бы чатов на него ни подписалось
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS watched_listings (
+            listing_id TEXT PRIMARY KEY,
+            url TEXT NOT NULL,
+            snapshot TEXT NOT NULL,
+            interval REAL NOT NULL,
+            next_check REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            chat_id INTEGER NOT NULL,
+            listing_id TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (chat_id, listing_id)
+        );
+        CREATE INDEX IF NOT EXISTS subscriptions_listing ON subscriptions (listing_id);
+        CREATE INDEX IF NOT EXISTS watched_listings_next_check ON watched_listings (next_check);
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connect = LocalConnection(path)
+        self._connect().executescript(self.SCHEMA)
+
+    def add(self, chat_id, listing, interval, next_check):
+        # Возвращает время следующей проверки: у уже проверяемого объявления оно не меняется
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                "INSERT OR IGNORE INTO watched_listings VALUES (?, ?, ?, ?, ?)",
+                (listing.listing_id, listing.url, json.dumps(listing.to_dict(), ensure_ascii=False),
+                 interval, next_check),
+            )
+            connection.execute(
+                "INSERT OR IGNORE INTO subscriptions VALUES (?, ?, ?)", (chat_id, listing.listing_id, time.time())
+            )
+            return connection.execute(
+                "SELECT next_check FROM watched_listings WHERE listing_id = ?", (listing.listing_id,)
+            ).fetchone()[0]
+
+    def remove(self, chat_id, listing_id):
+        connection = self._connect()
+        with connection:
+            removed = connection.execute(
+                "DELETE FROM subscriptions WHERE chat_id = ? AND listing_id = ?", (chat_id, listing_id)
+            ).rowcount
+            self._drop_unwatched(connection, listing_id)
+        return bool(removed)
+
+    def drop(self, listing_id):
+        # Объявление снято с сайта: удаляем его вместе со всеми подписками
+        connection = self._connect()
+        with connection:
+            connection.execute("DELETE FROM subscriptions WHERE listing_id = ?", (listing_id,))
+            self._drop_unwatched(connection, listing_id)
+
+    def _drop_unwatched(self, connection, listing_id):
+        connection.execute(
+            "DELETE FROM watched_listings WHERE listing_id = ?"
+            " AND NOT EXISTS (SELECT 1 FROM subscriptions WHERE listing_id = ?)",
+            (listing_id, listing_id),
+        )
+
+    def get(self, listing_id):
+        # (url, снимок, интервал) или None, если подписок больше нет
+        row = self._connect().execute(
+            "SELECT url, snapshot, interval FROM watched_listings WHERE listing_id = ?", (listing_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        url, snapshot, interval = row
+        return url, json.loads(snapshot), interval
+
+    def update(self, listing_id, snapshot, interval, next_check):
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                "UPDATE watched_listings SET snapshot = ?, interval = ?, next_check = ? WHERE listing_id = ?",
+                (json.dumps(snapshot, ensure_ascii=False), interval, next_check, listing_id),
+            )
+
+    def chats(self, listing_id):
+        return [row[0] for row in self._connect().execute(
+            "SELECT chat_id FROM subscriptions WHERE listing_id = ?", (listing_id,)
+        )]
+
+    def by_chat(self, chat_id):
+        return self._connect().execute(
+            "SELECT w.listing_id, w.url FROM subscriptions s JOIN watched_listings w USING (listing_id)"
+            " WHERE s.chat_id = ? ORDER BY s.created_at",
+            (chat_id,),
+        ).fetchall()
+
+    def schedule(self, until=None):
+        # (время проверки, listing_id) объявлений, которые надо проверить до until (всех при None)
+        return self._connect().execute(
+            "SELECT next_check, listing_id FROM watched_listings WHERE next_check <= ?",
+            (float("inf") if until is None else until,),
+        ).fetchall()
+
+
+class Watcher:
+    def __init__(self, store, parser, notify, interval=3600, min_interval=900, max_interval=24 * 3600,
+                 concurrency=8, batch_size=100, sync_interval=60):
+        # notify(chat_ids, url, listing, changes) - корутина, которая отправляет уведомления;
+        # при снятом объявлении listing равен None
+        self.store = store
+        self.parser = parser
+        self.notify = notify
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        # Подписки, добавленные другими процессами, подхватываются из базы раз в sync_interval секунд
+        self.sync_interval = sync_interval
+        # Куча (время проверки, listing_id); устаревшие элементы пропускаются при извлечении
+        self._heap = []
+        self._due = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def _push(self, listing_id, next_check):
+        self._due[listing_id] = next_check
+        heapq.heappush(self._heap, (next_check, listing_id))
+
+    def _jitter(self, interval):
+        # ±10%: объявления, добавленные вместе, со временем расходятся по расписанию
+        return interval * random.uniform(0.9, 1.1)
+
+    async def watch(self, chat_id, listing):
+        next_check = self.store.add(chat_id, listing, self.interval, time.time() + self._jitter(self.interval))
+        # В процессе без планировщика подписка только сохраняется
+        if self._task is not None and self._due.get(listing.listing_id) != next_check:
+            self._push(listing.listing_id, next_check)
+            self._wakeup.set()
+
+    def _sync(self, until=None):
+        for next_check, listing_id in self.store.schedule(until):
+            if self._due.get(listing_id) != next_check:
+                self._push(listing_id, next_check)
+
+    def start(self):
+        self._sync()
+        self._task = asyncio.create_task(self._run())
+        self._task.add_done_callback(self._stopped)
+
+    def _stopped(self, task):
+        # Планировщик один на процесс: если он упал, подписки больше не проверяются
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Проверка подписок остановлена", exc_info=task.exception())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _take_due(self, now):
+        batch = []
+        while self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size:
+            next_check, listing_id = heapq.heappop(self._heap)
+            if self._due.get(listing_id) == next_check:
+                del self._due[listing_id]
+                batch.append(listing_id)
+        return batch
+
+    async def _run(self):
+        limit = asyncio.Semaphore(self.concurrency)
+
+        async def check(listing_id):
+            async with limit:
+                try:
+                    await self._check(listing_id)
+                except Exception:
+                    # Например, база заблокирована дольше таймаута: объявление уже вынуто из кучи,
+                    # без повторной постановки оно не проверялось бы до перезапуска
+                    logger.exception(f"Ошибка при проверке объявления {listing_id}")
+                    self._push(listing_id, time.time() + self._jitter(self.min_interval))
+
+        synced = time.time()
+        while True:
+            if time.time() - synced >= self.sync_interval:
+                synced = time.time()
+                try:
+                    self._sync(synced + self.sync_interval)
+                except Exception:
+                    logger.exception("Не удалось сверить подписки с базой")
+            batch = self._take_due(time.time())
+            if batch:
+                await asyncio.gather(*(check(listing_id) for listing_id in batch))
+                continue
+            # Спим до ближайшей проверки, новой подписки или сверки с базой
+            timeout = synced + self.sync_interval - time.time()
+            if self._heap:
+                timeout = min(timeout, self._heap[0][0] - time.time())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _check(self, listing_id):
+        watched = self.store.get(listing_id)
+        if watched is None:
+            return
+        url, snapshot, interval = watched
+        try:
+            listing = await self.parser.parse_async(url, use_cache=False)
+        except Exception as e:
+            if isinstance(e, DownloadError) and e.status in (404, 410):
+                logger.info(f"Объявление {listing_id} снято, подписки удалены")
+                await self._notify(self.store.chats(listing_id), url, None, [])
+                self.store.drop(listing_id)
+                return
+            # Проверка не удалась: интервал не меняем, попробуем в следующий раз
+            logger.warning(f"Не удалось проверить {url}: {e}")
+            changes = None
+        else:
+            changes = listing_changes(snapshot, listing.to_dict())
+
+        if changes:
+            await self._notify(self.store.chats(listing_id), url, listing, changes)
+            snapshot = listing.to_dict()
+            interval = max(self.min_interval, interval / 2)
+        elif changes is not None:
+            interval = min(self.max_interval, interval * 1.5)
+        next_check = time.time() + self._jitter(interval)
+        self.store.update(listing_id, snapshot, interval, next_check)
+        self._push(listing_id, next_check)
+
+    async def _notify(self, chat_ids, url, listing, changes):
+        try:
+            await self.notify(chat_ids, url, listing, changes)
+        except Exception as e:
+            logger.error(f"Не удалось отправить уведомление: {e}")